@@ -2,17 +2,19 @@
 FastAPI Backend for Stereo Vision Perception System
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse
 import numpy as np
 import cv2
 import time
-from typing import List, Dict
+import asyncio
+from typing import List, Dict, Literal
 import logging
 from io import BytesIO
 
 # Import our existing modules
 from pipeline.main_pipeline import StereoVisionPipeline
+from backend.scheduler import BatchScheduler, MAX_BATCH
 
 # Configure logging
 logging.basicConfig(
@@ -21,38 +23,92 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# libjpeg-turbo decoder (optional, falls back to cv2.imdecode)
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    _tj = TurboJPEG()
+except (ImportError, RuntimeError, OSError):
+    _tj = None
+
 # Create FastAPI app
 app = FastAPI(
     title="Stereo Vision Perception API",
     description="Real-time 3D object detection and localization from stereo images",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Global pipeline instance (loaded once at startup)
 pipeline = None
 
-# Performance metrics storage
+# Micro-batcher feeding the pipeline (started with the server)
+scheduler = None
+
+# Timed pipeline components and how many recent samples to keep per component
+COMPONENTS = ('disparity', 'depth', 'detection', 'localization')
+METRICS_WINDOW = 4096
+
+# Performance metrics storage: lifetime running stats per component (O(1)
+# to update and read) plus fixed-size ring buffers of recent samples
 metrics = {
     'total_requests': 0,
     'successful_requests': 0,
     'failed_requests': 0,
     'avg_processing_time': 0.0,
-    'component_times': {
-        'disparity': [],
-        'depth': [],
-        'detection': [],
-        'localization': []
+    'component_times': {k: np.zeros(METRICS_WINDOW, dtype=np.float32) for k in COMPONENTS},
+    '_idx': {k: 0 for k in COMPONENTS},
+    'component_stats': {
+        k: {'n': 0, 's': 0.0, 's2': 0.0, 'mn': float('inf'), 'mx': float('-inf')}
+        for k in COMPONENTS
     }
 }
 
 
+def record_component_time(component, value):
+    """Update running stats and the ring buffer for a component timing (O(1), bounded memory)."""
+    stats = metrics['component_stats'][component]
+    stats['n'] += 1
+    stats['s'] += value
+    stats['s2'] += value * value
+    if value < stats['mn']:
+        stats['mn'] = value
+    if value > stats['mx']:
+        stats['mx'] = value
+    
+    idx = metrics['_idx'][component]
+    metrics['component_times'][component][idx] = value
+    metrics['_idx'][component] = (idx + 1) % METRICS_WINDOW
+
+
+def decode_image(data):
+    """
+    Decode uploaded image bytes to a BGR array.
+    
+    JPEG payloads are decoded with libjpeg-turbo when PyTurboJPEG is
+    installed; anything else (PNG, or no turbojpeg) goes through cv2.imdecode.
+    
+    Args:
+        data: Raw encoded image bytes
+        
+    Returns:
+        image: Decoded image (H x W x 3) BGR, or None if decoding failed
+    """
+    if _tj is not None and data[:2] == b'\xff\xd8':
+        try:
+            return _tj.decode(data, pixel_format=TJPF_BGR)
+        except OSError:
+            return None
+    
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
 @app.on_event("startup")
 async def startup_event():
     """
     Initialize pipeline on server startup.
     Loads YOLO model and calibration once.
     """
-    global pipeline
+    global pipeline, scheduler
     
     logger.info("Starting Stereo Vision API...")
     logger.info("Initializing perception pipeline...")
@@ -61,15 +117,30 @@ async def startup_event():
         pipeline = StereoVisionPipeline(
             config_path='calibration/kitti_stereo_params.yaml',
             yolo_model='yolov8n.pt',
-            yolo_confidence=0.5
+            yolo_confidence=0.5,
+            yolo_tensorrt=True,
+            yolo_max_batch=MAX_BATCH,
+            half_res_disparity=True
         )
         logger.info("Pipeline initialized successfully")
+        
+        scheduler = BatchScheduler(pipeline, max_batch=MAX_BATCH)
+        scheduler.start()
+        logger.info(f"Batch scheduler started (max batch {scheduler.max_batch})")
+        
         logger.info("API ready to accept requests")
     except Exception as e:
         logger.error(f"Failed to initialize pipeline: {e}")
         raise
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the batch scheduler on server shutdown."""
+    if scheduler is not None:
+        await scheduler.stop()
+
+
 @app.get("/")
 async def root():
     """Root endpoint with API information."""
@@ -79,6 +150,7 @@ async def root():
         "status": "running",
         "endpoints": {
             "detect": "/api/v1/detect",
+            "detect_raw": "/api/v1/detect_raw",
             "health": "/api/v1/health",
             "metrics": "/api/v1/metrics",
             "docs": "/docs"
@@ -99,6 +171,7 @@ async def health_check():
         "yolo_model": "loaded" if pipeline and pipeline.detector else "not loaded",
         "calibration": "loaded" if pipeline and pipeline.stereo_params else "not loaded",
         "stereo_matcher": "ready" if pipeline and pipeline.stereo else "not ready",
+        "batch_scheduler": "running" if scheduler and scheduler.running else "stopped",
         "total_requests_processed": metrics['total_requests'],
         "uptime": "running"
     }
@@ -107,7 +180,7 @@ async def health_check():
     if not pipeline:
         health_status['status'] = "unhealthy"
         health_status['error'] = "Pipeline not initialized"
-        return JSONResponse(status_code=503, content=health_status)
+        return ORJSONResponse(status_code=503, content=health_status)
     
     return health_status
 
@@ -117,20 +190,30 @@ async def get_metrics():
     """
     Get performance metrics.
     
-    Returns per-component timing breakdowns and overall statistics.
+    Returns per-component timing breakdowns and overall statistics. Lifetime
+    avg/min/max/std come from running sums; recent_avg_ms averages the last
+    METRICS_WINDOW samples.
     """
-    # Calculate average times for each component
     avg_times = {}
-    for component, times in metrics['component_times'].items():
-        if times:
+    for component, stats in metrics['component_stats'].items():
+        n = stats['n']
+        if n:
+            mean_time = stats['s'] / n
+            var_time = max(stats['s2'] / n - mean_time * mean_time, 0.0)
+            # The ring buffer is only filled up to n until it wraps
+            recent = metrics['component_times'][component][:min(n, METRICS_WINDOW)]
             avg_times[component] = {
-                'avg_ms': np.mean(times) * 1000,
-                'min_ms': np.min(times) * 1000,
-                'max_ms': np.max(times) * 1000,
-                'avg_fps': 1.0 / np.mean(times) if np.mean(times) > 0 else 0
+                'avg_ms': mean_time * 1000,
+                'min_ms': stats['mn'] * 1000,
+                'max_ms': stats['mx'] * 1000,
+                'std_ms': var_time ** 0.5 * 1000,
+                'recent_avg_ms': float(recent.mean()) * 1000,
+                'avg_fps': 1.0 / mean_time if mean_time > 0 else 0,
+                'count': n
             }
         else:
-            avg_times[component] = {'avg_ms': 0, 'min_ms': 0, 'max_ms': 0, 'avg_fps': 0}
+            avg_times[component] = {'avg_ms': 0, 'min_ms': 0, 'max_ms': 0, 'std_ms': 0,
+                                    'recent_avg_ms': 0, 'avg_fps': 0, 'count': 0}
     
     return {
         "total_requests": metrics['total_requests'],
@@ -144,10 +227,109 @@ async def get_metrics():
     }
 
 
+def format_objects(objects):
+    """
+    Build the detected_objects response list from struct-of-arrays objects.
+    
+    Args:
+        objects: Dictionary of arrays from localize_objects_arrays()
+        
+    Returns:
+        detected_objects: List of JSON-serializable object dictionaries
+    """
+    # Bulk-convert columns once instead of touching NumPy scalars per field
+    bboxes = objects['bbox'].tolist()
+    xyz = objects['xyz'].tolist()
+    names = objects['class_name'].tolist()
+    confidences = objects['confidence'].tolist()
+    distances = objects['distance'].tolist()
+    depths = objects['depth'].tolist()
+    
+    detected_objects = []
+    for i in range(len(depths)):
+        x, y, z = xyz[i]
+        detected_objects.append({
+            "class_name": names[i],
+            "confidence": confidences[i],
+            "bbox_2d": bboxes[i],
+            "position_3d": {"x": x, "y": y, "z": z},
+            "distance_m": distances[i],
+            "depth_m": depths[i]
+        })
+    
+    return detected_objects
+
+
+async def _process_pair(left_img, right_img, reuse, start_time):
+    """
+    Run a decoded stereo pair through the scheduler and build the response.
+    
+    Args:
+        left_img: Left image (H x W x 3) BGR
+        right_img: Right image (H x W x 3) BGR
+        reuse: 'auto' or 'never' depth reuse mode
+        start_time: Request start time (time.time())
+        
+    Returns:
+        response: JSON-serializable response dictionary
+    """
+    # Validate image shapes match
+    if left_img.shape != right_img.shape:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Image shape mismatch: left {left_img.shape} vs right {right_img.shape}"
+        )
+    
+    logger.info(f"Images loaded: {left_img.shape}")
+    
+    # Process through pipeline (YOLO is batched with concurrent requests)
+    results = await scheduler.submit(left_img, right_img, reuse_depth=(reuse == 'auto'))
+    
+    # Update metrics
+    for component, value in results['timings'].items():
+        if component in metrics['component_times']:
+            record_component_time(component, value)
+    
+    # Format response
+    response = {
+        "success": True,
+        "processing_time_ms": results['timings']['total'] * 1000,
+        "fps": results['fps'],
+        "image_shape": list(left_img.shape),
+        "depth_reused": results['depth_reused'],
+        "depth_statistics": {
+            "valid_pixels_percent": results['depth_stats']['valid_percentage'],
+            "min_depth_m": results['depth_stats']['min_depth'],
+            "max_depth_m": results['depth_stats']['max_depth'],
+            "mean_depth_m": results['depth_stats']['mean_depth']
+        },
+        "detected_objects": format_objects(results['objects_3d_arrays']),
+        "num_objects": len(results['objects_3d_arrays']['depth']),
+        "component_timings_ms": {
+            key: value * 1000 for key, value in results['timings'].items()
+        }
+    }
+    
+    # Update success metrics
+    metrics['successful_requests'] += 1
+    total_time = time.time() - start_time
+    metrics['avg_processing_time'] = (
+        (metrics['avg_processing_time'] * (metrics['successful_requests'] - 1) + total_time) 
+        / metrics['successful_requests']
+    )
+    
+    logger.info(f"Request processed successfully: {len(results['objects_3d_arrays']['depth'])} objects detected in {total_time*1000:.1f}ms")
+    
+    return response
+
+
 @app.post("/api/v1/detect")
 async def detect_objects(
     left_image: UploadFile = File(..., description="Left camera image"),
-    right_image: UploadFile = File(..., description="Right camera image")
+    right_image: UploadFile = File(..., description="Right camera image"),
+    reuse: Literal['auto', 'never'] = Query(
+        'never', description="Reuse depth from a recent identical frame (video streams)"
+    )
 ):
     """
     Detect and localize objects in 3D from stereo image pair.
@@ -155,6 +337,7 @@ async def detect_objects(
     Args:
         left_image: Left camera image file
         right_image: Right camera image file
+        reuse: 'auto' to skip disparity/depth when the frame matches a recent one
         
     Returns:
         JSON with detected objects, 3D positions, and performance metrics
@@ -164,7 +347,7 @@ async def detect_objects(
     
     try:
         # Validate pipeline is loaded
-        if pipeline is None:
+        if pipeline is None or scheduler is None:
             raise HTTPException(status_code=503, detail="Pipeline not initialized")
         
         # Read and decode images
@@ -173,13 +356,11 @@ async def detect_objects(
         left_bytes = await left_image.read()
         right_bytes = await right_image.read()
         
-        # Convert bytes to numpy arrays
-        left_arr = np.frombuffer(left_bytes, np.uint8)
-        right_arr = np.frombuffer(right_bytes, np.uint8)
-        
-        # Decode images
-        left_img = cv2.imdecode(left_arr, cv2.IMREAD_COLOR)
-        right_img = cv2.imdecode(right_arr, cv2.IMREAD_COLOR)
+        # Decode both images concurrently off the event loop
+        left_img, right_img = await asyncio.gather(
+            asyncio.to_thread(decode_image, left_bytes),
+            asyncio.to_thread(decode_image, right_bytes)
+        )
         
         # Validate images loaded correctly
         if left_img is None:
@@ -187,80 +368,103 @@ async def detect_objects(
         if right_img is None:
             raise HTTPException(status_code=400, detail="Failed to decode right image")
         
-        # Validate image shapes match
-        if left_img.shape != right_img.shape:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Image shape mismatch: left {left_img.shape} vs right {right_img.shape}"
-            )
+        response = await _process_pair(left_img, right_img, reuse, start_time)
         
-        logger.info(f"Images loaded: {left_img.shape}")
+        # orjson serializes NumPy scalars/arrays directly, no per-value conversion
+        return ORJSONResponse(content=response)
         
-        # Process through pipeline
-        results = pipeline.process_stereo_pair(
-            left_img, 
-            right_img,
-            generate_pc=False,  # Skip point clouds for API (too slow/large)
-            save_outputs=False
-        )
+    except HTTPException:
+        # Re-raise HTTP exceptions
+        metrics['failed_requests'] += 1
+        raise
         
-        # Update metrics
-        for component, value in results['timings'].items():
-            if component in metrics['component_times']:
-                metrics['component_times'][component].append(value)
+    except Exception as e:
+        # Log and return internal server error
+        metrics['failed_requests'] += 1
+        logger.error(f"Error processing request: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+
+def parse_raw_pair(body, shape_header, left_bytes_header):
+    """
+    Build zero-copy image views from a raw stereo upload.
+    
+    Args:
+        body: Request body (left pixels followed by right pixels)
+        shape_header: Image shape as "H,W,3"
+        left_bytes_header: Byte length of the left image
         
-        # Format response
-        response = {
-            "success": True,
-            "processing_time_ms": results['timings']['total'] * 1000,
-            "fps": results['fps'],
-            "image_shape": list(left_img.shape),
-            "depth_statistics": {
-                "valid_pixels_percent": results['depth_stats']['valid_percentage'],
-                "min_depth_m": results['depth_stats']['min_depth'],
-                "max_depth_m": results['depth_stats']['max_depth'],
-                "mean_depth_m": results['depth_stats']['mean_depth']
-            },
-            "detected_objects": [
-                {
-                    "class_name": obj['class_name'],
-                    "confidence": obj['confidence'],
-                    "bbox_2d": obj['bbox'],
-                    "position_3d": {
-                        "x": obj['position_3d']['X'],
-                        "y": obj['position_3d']['Y'],
-                        "z": obj['position_3d']['Z']
-                    },
-                    "distance_m": obj['distance'],
-                    "depth_m": obj['depth']
-                }
-                for obj in results['objects_3d']
-            ],
-            "num_objects": len(results['objects_3d']),
-            "component_timings_ms": {
-                key: value * 1000 for key, value in results['timings'].items()
-            }
-        }
+    Returns:
+        left_img, right_img: uint8 (H x W x 3) BGR views into body
+    """
+    try:
+        shape = tuple(int(v) for v in shape_header.split(','))
+        n = int(left_bytes_header)
+    except (AttributeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid x-shape or x-left-bytes header")
+    
+    if len(shape) != 3 or shape[2] != 3 or min(shape) <= 0:
+        raise HTTPException(status_code=400, detail=f"x-shape must be H,W,3, got {shape_header}")
+    
+    expected = shape[0] * shape[1] * 3
+    if n != expected or len(body) != 2 * expected:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Body size mismatch: expected 2 x {expected} bytes, got left {n} / total {len(body)}"
+        )
+    
+    left_img = np.frombuffer(body, dtype=np.uint8, count=expected).reshape(shape)
+    right_img = np.frombuffer(body, dtype=np.uint8, count=expected, offset=expected).reshape(shape)
+    
+    return left_img, right_img
+
+
+@app.post("/api/v1/detect_raw")
+async def detect_objects_raw(
+    request: Request,
+    reuse: Literal['auto', 'never'] = Query(
+        'never', description="Reuse depth from a recent identical frame (video streams)"
+    )
+):
+    """
+    Detect objects from raw uint8 BGR buffers, skipping image decode.
+    
+    Intended for trusted callers on the internal network only: the body is
+    the left image followed by the right image, both C-contiguous uint8 BGR,
+    described by the headers
+        x-shape: "H,W,3" (e.g. "375,1242,3")
+        x-left-bytes: byte length of the left image (H*W*3)
+    
+    Args:
+        request: Raw HTTP request
+        reuse: 'auto' to skip disparity/depth when the frame matches a recent one
         
-        # Update success metrics
-        metrics['successful_requests'] += 1
-        total_time = time.time() - start_time
-        metrics['avg_processing_time'] = (
-            (metrics['avg_processing_time'] * (metrics['successful_requests'] - 1) + total_time) 
-            / metrics['successful_requests']
+    Returns:
+        JSON with detected objects, 3D positions, and performance metrics
+    """
+    metrics['total_requests'] += 1
+    start_time = time.time()
+    
+    try:
+        if pipeline is None or scheduler is None:
+            raise HTTPException(status_code=503, detail="Pipeline not initialized")
+        
+        body = await request.body()
+        left_img, right_img = parse_raw_pair(
+            body,
+            request.headers.get('x-shape'),
+            request.headers.get('x-left-bytes')
         )
         
-        logger.info(f"Request processed successfully: {len(results['objects_3d'])} objects detected in {total_time*1000:.1f}ms")
+        response = await _process_pair(left_img, right_img, reuse, start_time)
         
-        return response
+        return ORJSONResponse(content=response)
         
     except HTTPException:
-        # Re-raise HTTP exceptions
         metrics['failed_requests'] += 1
         raise
         
     except Exception as e:
-        # Log and return internal server error
         metrics['failed_requests'] += 1
-        logger.error(f"Error processing request: {e}", exc_info=True)
+        logger.error(f"Error processing raw request: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
@@ -0,0 +1,166 @@
+"""
+Request-level micro-batching for the detection endpoint
+"""
+
+import asyncio
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Batching limits
+MAX_BATCH = 8       # Max requests coalesced into one YOLO forward pass
+MAX_WAIT_MS = 10    # Max time to wait for more requests after the first
+
+
+class BatchScheduler:
+    """
+    Coalesces concurrent stereo requests into batched YOLO inference.
+
+    Requests are queued together with a future. A background task collects
+    up to max_batch of them (waiting at most max_wait_ms after the first
+    arrives), runs one batched detection over the left images, then finishes
+    disparity, depth and localization per pair and resolves each future.
+    """
+
+    def __init__(self, pipeline, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        """
+        Create a scheduler for a pipeline.
+
+        Args:
+            pipeline: StereoVisionPipeline instance
+            max_batch: Maximum number of requests per batch
+            max_wait_ms: Coalescing window in milliseconds
+        """
+        self.pipeline = pipeline
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start the background batching task (call from the event loop)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background batching task."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, left_img, right_img, **kwargs):
+        """
+        Queue a stereo pair and wait for its pipeline results.
+
+        Args:
+            left_img: Left image (H x W x 3) BGR
+            right_img: Right image (H x W x 3) BGR
+            **kwargs: Extra keyword arguments for process_stereo_pair
+
+        Returns:
+            results: Pipeline results dictionary (without the 'disparity' and
+                'depth_map' arrays, which are not valid past the batch)
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((left_img, right_img, kwargs, future))
+        return await future
+
+    async def _collect(self):
+        """Wait for one request, then gather more until the batch is full or the window closes."""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Drop requests whose clients have already gone away
+        return [item for item in batch if not item[3].cancelled()]
+
+    @staticmethod
+    def _resolve(future, outcome):
+        """Set a request's result or exception (on the event loop), unless it was cancelled."""
+        if future.done():
+            return
+        if isinstance(outcome, Exception):
+            future.set_exception(outcome)
+        else:
+            future.set_result(outcome)
+
+    async def _run(self):
+        """Background loop: collect, then process off the event loop (futures resolve per pair)."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+
+            try:
+                await asyncio.to_thread(self._process_batch, batch, loop)
+            except Exception as e:
+                logger.error(f"Batch of {len(batch)} failed: {e}", exc_info=True)
+                # Fails any request not already answered
+                for _, _, _, future in batch:
+                    self._resolve(future, e)
+
+    def _process_batch(self, batch, loop):
+        """
+        Run one batched detection, then the per-pair stages.
+
+        Each request's future is resolved as soon as its own pair finishes,
+        so the first request in a batch does not wait for the others'
+        disparity passes.
+
+        Args:
+            batch: List of (left_img, right_img, kwargs, future) tuples
+            loop: Event loop owning the futures
+        """
+        # Step 1: Single YOLO forward pass over all left images
+        t0 = time.time()
+        batch_detections = self.pipeline.detector.detect_arrays([left_img for left_img, _, _, _ in batch])
+        detection_time = time.time() - t0
+
+        # Step 2: Disparity, depth and localization per pair
+        for (left_img, right_img, kwargs, future), detections in zip(batch, batch_detections):
+            try:
+                results = self.pipeline.process_stereo_pair(
+                    left_img,
+                    right_img,
+                    generate_pc=False,
+                    save_outputs=False,
+                    detections=detections,
+                    **kwargs
+                )
+
+                # The maps live in pipeline-owned buffers that the next pair in
+                # this batch overwrites; drop them rather than hand out aliases
+                results.pop('disparity', None)
+                results.pop('depth_map', None)
+
+                # Account for the shared detection pass
+                timings = results['timings']
+                timings['detection'] = detection_time
+                timings['total'] += detection_time
+                results['fps'] = 1.0 / timings['total']
+                results['batch_size'] = len(batch)
+
+                outcome = results
+            except Exception as e:
+                outcome = e
+
+            loop.call_soon_threadsafe(self._resolve, future, outcome)
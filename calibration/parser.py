@@ -1,17 +1,61 @@
 import numpy as np
 import yaml
 import os
+import zipfile
+from functools import lru_cache
 
-def parse_kitti_calib(calib_file_path):
+
+def _cache_path(source_path):
+    """Path of the .npz cache kept next to a source file."""
+    return os.path.splitext(source_path)[0] + '.npz'
+
+
+def _load_npz_cache(source_path):
+    """
+    Load cached arrays for source_path if the cache is up to date.
+    
+    Returns:
+        arrays: Dictionary of arrays, or None if the cache is missing or stale
+    """
+    try:
+        with np.load(_cache_path(source_path)) as cache:
+            if float(cache['source_mtime']) != os.path.getmtime(source_path):
+                return None
+            return {key: cache[key] for key in cache.files if key != 'source_mtime'}
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+
+
+def _save_npz_cache(source_path, arrays):
+    """Write arrays to the .npz cache for source_path, tagged with its mtime."""
+    try:
+        np.savez(_cache_path(source_path), source_mtime=os.path.getmtime(source_path), **arrays)
+    except OSError:
+        # Read-only location (e.g. mounted volume), just skip caching
+        pass
+
+
+def parse_kitti_calib(calib_file_path, use_cache=True):
     """
     Parse KITTI calibration file (calib_cam_to_cam.txt).
     
+    The parsed result is cached as an .npz next to the file and reused
+    while the file's modification time is unchanged.
+    
     Args:
         calib_file_path: Path to calib_cam_to_cam.txt
+        use_cache: Read/write the .npz cache
         
     Returns:
         calib_dict: Dictionary with calibration parameters
     """
+    if use_cache:
+        cached = _load_npz_cache(calib_file_path)
+        if cached is not None:
+            # 0-d arrays hold scalar entries (floats or strings)
+            return {key: value.item() if value.ndim == 0 else value
+                    for key, value in cached.items()}
+    
     calib = {}
     
     with open(calib_file_path, 'r') as f:
@@ -25,20 +69,22 @@ def parse_kitti_calib(calib_file_path):
             key = parts[0].rstrip(':')  # Remove colon from key
             values = parts[1:]
             
-            # Try to convert to floats, if it fails keep as string
+            # Convert all values in one call; if it fails keep as string
             try:
-                if len(values) > 1:
-                    # Multiple values - try to make array
-                    calib[key] = np.array([float(v) for v in values])
-                elif len(values) == 1:
-                    # Single value - try to make float, otherwise keep as string
-                    try:
-                        calib[key] = float(values[0])
-                    except ValueError:
-                        calib[key] = values[0]
+                numbers = np.array(values, dtype=np.float64)
             except ValueError:
-                # If conversion fails, store as string
                 calib[key] = ' '.join(values)
+                continue
+            
+            if len(values) > 1:
+                # Multiple values - keep as array
+                calib[key] = numbers
+            elif len(values) == 1:
+                # Single value - plain float
+                calib[key] = float(numbers[0])
+    
+    if use_cache:
+        _save_npz_cache(calib_file_path, calib)
     
     return calib
 
@@ -109,14 +155,110 @@ def extract_stereo_params(calib_dict):
     return stereo_params
 
 
+def intrinsics_inverse(stereo_params, camera='left'):
+    """
+    Inverse camera matrix for back-projecting pixels to rays.
+    
+    Args:
+        stereo_params: Dictionary from extract_stereo_params / load_stereo_params
+        camera: 'left' or 'right'
+        
+    Returns:
+        K_inv: 3x3 float64 array, K_inv @ [u, v, 1] = ray with unit Z
+    """
+    cam = stereo_params[camera]
+    K = np.array([
+        [cam['fx'], 0.0, cam['cx']],
+        [0.0, cam['fy'], cam['cy']],
+        [0.0, 0.0, 1.0]
+    ], dtype=np.float64)
+    return np.linalg.inv(K)
+
+
+@lru_cache(maxsize=8)
+def _reprojection_matrix(fx, fy, cx, cy, baseline):
+    """Build (once per calibration) the read-only float32 Q matrix."""
+    Q = np.array([
+        [1.0, 0.0, 0.0, -cx],
+        [0.0, fx / fy, 0.0, -cy * fx / fy],
+        [0.0, 0.0, 0.0, fx],
+        [0.0, 0.0, 1.0 / baseline, 0.0]
+    ], dtype=np.float32)
+    Q.flags.writeable = False
+    return Q
+
+
+def get_Q(stereo_params):
+    """
+    Disparity-to-depth reprojection matrix for cv2.reprojectImageTo3D.
+    
+    For the rectified pair (same cx in both cameras) Q maps
+    [u, v, d, 1] to [X, Y, Z, W] with Z/W = fx * baseline / d, in the
+    left camera frame. Cached per (fx, fy, cx, cy, baseline).
+    
+    Args:
+        stereo_params: Dictionary from extract_stereo_params / load_stereo_params
+        
+    Returns:
+        Q: 4x4 float32 array (read-only, shared)
+    """
+    cam = stereo_params['left']
+    return _reprojection_matrix(float(cam['fx']), float(cam['fy']), float(cam['cx']),
+                                float(cam['cy']), float(stereo_params['baseline']))
+
+
+CAMERA_KEYS = ('K', 'D', 'R_rect', 'P_rect', 'fx', 'fy', 'cx', 'cy')
+
+
+def _stereo_params_to_arrays(stereo_params):
+    """Flatten stereo parameters into named arrays (e.g. left_K, right_fx) for np.savez."""
+    arrays = {
+        f'{camera}_{key}': np.asarray(stereo_params[camera][key], dtype=np.float64)
+        for camera in ('left', 'right')
+        for key in CAMERA_KEYS
+    }
+    arrays['baseline'] = np.float64(stereo_params['baseline'])
+    arrays['image_size'] = np.asarray(stereo_params['image_size'], dtype=np.int64)
+    return arrays
+
+
+def _stereo_params_from_arrays(arrays):
+    """Rebuild the stereo parameter dictionary from named arrays."""
+    stereo_params = {}
+    
+    for camera in ('left', 'right'):
+        stereo_params[camera] = {}
+        for key in CAMERA_KEYS:
+            value = arrays[f'{camera}_{key}']
+            # 0-d arrays hold scalar entries (fx, fy, cx, cy)
+            stereo_params[camera][key] = value.item() if value.ndim == 0 else value
+    
+    stereo_params['baseline'] = arrays['baseline'].item()
+    stereo_params['image_size'] = arrays['image_size'].tolist()
+    
+    return stereo_params
+
+
 def save_stereo_params(stereo_params, output_path='calibration/kitti_stereo_params.yaml'):
     """
-    Save stereo parameters to YAML file.
+    Save stereo parameters.
+    
+    A .npz output_path stores the arrays only. Otherwise a human-readable
+    YAML file is written, plus an .npz cache next to it that
+    load_stereo_params() reads instead of parsing the YAML.
     
     Args:
         stereo_params: Dictionary from extract_stereo_params
-        output_path: Where to save the YAML file
+        output_path: Where to save the parameters (.yaml or .npz)
     """
+    # Ensure directory exists
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    
+    if output_path.endswith('.npz'):
+        np.savez(output_path, **_stereo_params_to_arrays(stereo_params))
+        print(f"Saved stereo parameters to {output_path}")
+        return
+    
     # Convert numpy arrays to lists for YAML serialization
     save_dict = {}
     
@@ -135,19 +277,22 @@ def save_stereo_params(stereo_params, output_path='calibration/kitti_stereo_para
     save_dict['baseline'] = float(stereo_params['baseline'])
     save_dict['image_size'] = stereo_params['image_size']
     
-    # Ensure directory exists
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    
     # Save to YAML
     with open(output_path, 'w') as f:
         yaml.dump(save_dict, f, default_flow_style=False)
     
+    # Binary copy for fast loading (tagged with the YAML's mtime)
+    _save_npz_cache(output_path, _stereo_params_to_arrays(stereo_params))
+    
     print(f"Saved stereo parameters to {output_path}")
 
 
 def load_stereo_params(param_path='calibration/kitti_stereo_params.yaml'):
     """
-    Load stereo parameters from YAML file.
+    Load stereo parameters from a YAML or .npz file.
+    
+    For YAML, the .npz cache next to it is used while it matches the YAML's
+    modification time; otherwise the YAML is parsed and the cache rewritten.
     
     Args:
         param_path: Path to saved parameters
@@ -155,6 +300,18 @@ def load_stereo_params(param_path='calibration/kitti_stereo_params.yaml'):
     Returns:
         stereo_params: Dictionary with numpy arrays
     """
+    if param_path.endswith('.npz'):
+        with np.load(param_path) as arrays:
+            return _stereo_params_from_arrays(arrays)
+    
+    cached = _load_npz_cache(param_path)
+    if cached is not None:
+        try:
+            return _stereo_params_from_arrays(cached)
+        except KeyError:
+            # Cache written by an older layout, fall back to the YAML
+            pass
+    
     with open(param_path, 'r') as f:
         save_dict = yaml.safe_load(f)
     
@@ -176,4 +333,6 @@ def load_stereo_params(param_path='calibration/kitti_stereo_params.yaml'):
     stereo_params['baseline'] = save_dict['baseline']
     stereo_params['image_size'] = save_dict['image_size']
     
+    _save_npz_cache(param_path, _stereo_params_to_arrays(stereo_params))
+    
     return stereo_params
@@ -47,9 +47,9 @@ def main():
     annotated = draw_3d_positions(left_img, results['objects_3d'])
     
     # Display
-    left_rgb = cv2.cvtColor(left_img, cv2.COLOR_BGR2RGB)
-    annotated_rgb = cv2.cvtColor(annotated, cv2.COLOR_BGR2RGB)
-    depth_viz = (results['depth_map'] / 50.0 * 255).astype('uint8')
+    left_rgb = left_img[..., ::-1]
+    annotated_rgb = annotated[..., ::-1]
+    depth_viz = cv2.convertScaleAbs(results['depth_map'], alpha=255.0 / 50.0)
     
     fig, axes = plt.subplots(1, 3, figsize=(18, 5))
     
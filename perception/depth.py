@@ -1,7 +1,96 @@
 import cv2
 import numpy as np
+from numba import njit, prange
 
-def compute_depth_map(disparity, focal_length, baseline, min_depth=0.5, max_depth=50.0):
+
+# JET colormap (BGR) as a 256-entry lookup table
+JET_LUT = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(-1, 1), cv2.COLORMAP_JET).reshape(256, 3)
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _depth_kernel(disparity, fb, min_depth, max_depth, out):
+    """Fused mask + divide + range clip, one pass over the disparity map."""
+    height, width = disparity.shape
+    for y in prange(height):
+        for x in range(width):
+            d = disparity[y, x]
+            if d > 0.1:
+                z = fb / d
+                out[y, x] = z if (z >= min_depth and z <= max_depth) else 0.0
+            else:
+                out[y, x] = 0.0
+
+
+@njit(parallel=True, cache=True)
+def _depth_color_kernel(depth_map, max_display_depth, lut, out):
+    """
+    Normalize depth to 0-255 and look up its color, one pass per pixel.
+    
+    The index is computed in float32 and truncated, in the same order of
+    operations as normalize_depth_for_display, so both paths agree exactly
+    (no fastmath: a reciprocal-multiply would change the rounding).
+    """
+    height, width = depth_map.shape
+    scale = np.float32(255.0)
+    for y in prange(height):
+        for x in range(width):
+            d = depth_map[y, x]
+            idx = 0
+            if d > 0:
+                normalized = np.float32(min(d, max_display_depth) / max_display_depth)
+                idx = int(scale - np.float32(normalized * scale))
+            out[y, x, 0] = lut[idx, 0]
+            out[y, x, 1] = lut[idx, 1]
+            out[y, x, 2] = lut[idx, 2]
+
+
+@njit(fastmath=True, cache=True)
+def _stats_kernel(depth_map):
+    """Count, sum, min and max of the valid (> 0) depths in one streaming pass."""
+    count = 0
+    total = 0.0
+    min_depth = 1e30
+    max_depth = -1e30
+    height, width = depth_map.shape
+    for y in range(height):
+        for x in range(width):
+            v = depth_map[y, x]
+            if v > 0:
+                count += 1
+                total += v
+                if v < min_depth:
+                    min_depth = v
+                if v > max_depth:
+                    max_depth = v
+    return count, total, min_depth, max_depth
+
+
+def warmup_kernels():
+    """
+    Compile the Numba kernels on tiny inputs so the first frame doesn't pay JIT cost.
+    """
+    depth_map = compute_depth_map(np.ones((2, 2), dtype=np.float32), 1.0, 1.0)
+    compute_depth_statistics(depth_map, compute_median=False)
+
+
+def partition_median(values):
+    """
+    Median of a 1D array using O(n) selection instead of a full sort.
+    
+    Args:
+        values: Non-empty 1D array (may be reordered in place)
+        
+    Returns:
+        median: Median value (float)
+    """
+    k = values.size // 2
+    values.partition(k)
+    if values.size & 1:
+        return float(values[k])
+    return float(0.5 * (values[k] + values[:k].max()))
+
+
+def compute_depth_map(disparity, focal_length, baseline, min_depth=0.5, max_depth=50.0, out=None):
     """
     Convert disparity map to depth map in meters.
     
@@ -11,68 +100,116 @@ def compute_depth_map(disparity, focal_length, baseline, min_depth=0.5, max_dept
         baseline: Stereo baseline in meters
         min_depth: Minimum valid depth in meters
         max_depth: Maximum valid depth in meters
+        out: Optional preallocated (H x W) float32 output buffer
         
     Returns:
         depth_map: Depth map (H x W) in meters
     """
-    valid_mask = disparity > 0.1
-    depth_map = np.zeros_like(disparity, dtype=np.float32)
-    depth_map[valid_mask] = (focal_length * baseline) / disparity[valid_mask]
-    depth_map[depth_map < min_depth] = 0
-    depth_map[depth_map > max_depth] = 0
-    return depth_map
+    disparity = np.asarray(disparity, dtype=np.float32)
+    
+    if out is None:
+        out = np.empty(disparity.shape, dtype=np.float32)
+    
+    _depth_kernel(disparity, float(focal_length * baseline), float(min_depth), float(max_depth), out)
+    return out
 
 
-def normalize_depth_for_display(depth_map, max_display_depth=30.0):
+def normalize_depth_for_display(depth_map, max_display_depth=30.0, out=None):
     """
     Normalize depth map to 0-255 range for visualization.
-    """
-    valid_depth = depth_map[depth_map > 0]
     
-    if len(valid_depth) == 0:
-        return np.zeros_like(depth_map, dtype=np.uint8)
+    Args:
+        depth_map: Depth map (H x W) in meters
+        max_display_depth: Depth mapped to 0 (farther is clipped)
+        out: Optional preallocated (H x W) uint8 output buffer
+    """
+    if out is None:
+        out = np.empty(depth_map.shape, dtype=np.uint8)
+    out[:] = 0
     
-    depth_clipped = np.clip(depth_map, 0, max_display_depth)
-    depth_viz = np.zeros_like(depth_map, dtype=np.uint8)
     valid_mask = depth_map > 0
-    depth_viz[valid_mask] = (255 - (depth_clipped[valid_mask] / max_display_depth * 255)).astype(np.uint8)
     
-    return depth_viz
+    if not valid_mask.any():
+        return out
+    
+    depth_clipped = np.clip(depth_map[valid_mask], 0, max_display_depth)
+    out[valid_mask] = (255 - (depth_clipped / max_display_depth * 255)).astype(np.uint8)
+    
+    return out
 
 
-def apply_depth_colormap(depth_normalized):
+def apply_depth_colormap(depth_normalized, out=None):
     """
     Apply color map to depth for better visualization.
+    
+    Args:
+        depth_normalized: Normalized depth (H x W) uint8
+        out: Optional preallocated (H x W x 3) uint8 output buffer
     """
-    depth_color = cv2.applyColorMap(depth_normalized, cv2.COLORMAP_JET)
+    depth_color = cv2.applyColorMap(depth_normalized, cv2.COLORMAP_JET, dst=out)
     return depth_color
 
 
-def compute_depth_statistics(depth_map):
+def colorize_depth(depth_map, max_display_depth=30.0, out=None):
+    """
+    Normalize and JET-colorize a depth map in a single pass.
+    
+    Same output as apply_depth_colormap(normalize_depth_for_display(...))
+    without the intermediate uint8 image.
+    
+    Args:
+        depth_map: Depth map (H x W) in meters
+        max_display_depth: Depth mapped to the far end of the colormap
+        out: Optional preallocated (H x W x 3) uint8 output buffer
+        
+    Returns:
+        depth_color: Colored depth map (H x W x 3) BGR
+    """
+    if out is None:
+        out = np.empty(depth_map.shape + (3,), dtype=np.uint8)
+    
+    _depth_color_kernel(depth_map, np.float32(max_display_depth), JET_LUT, out)
+    return out
+
+
+def compute_depth_statistics(depth_map, compute_median=True):
     """
     Compute statistics about the depth map.
+    
+    Count, min, max and mean come from a single pass over the map. The median
+    needs the valid depths gathered and is only computed when requested.
+    
+    Args:
+        depth_map: Depth map (H x W) in meters
+        compute_median: Whether to compute 'median_depth' (key omitted otherwise)
+        
+    Returns:
+        stats: Dictionary of depth statistics
     """
-    valid_depth = depth_map[depth_map > 0]
+    count, total, min_depth, max_depth = _stats_kernel(depth_map)
     
-    if len(valid_depth) == 0:
-        return {
+    if count == 0:
+        stats = {
             'valid_pixels': 0,
             'total_pixels': depth_map.size,
             'valid_percentage': 0.0,
             'min_depth': 0.0,
             'max_depth': 0.0,
-            'mean_depth': 0.0,
-            'median_depth': 0.0
+            'mean_depth': 0.0
         }
+        if compute_median:
+            stats['median_depth'] = 0.0
+        return stats
     
     stats = {
-        'valid_pixels': len(valid_depth),
+        'valid_pixels': count,
         'total_pixels': depth_map.size,
-        'valid_percentage': 100.0 * len(valid_depth) / depth_map.size,
-        'min_depth': float(valid_depth.min()),
-        'max_depth': float(valid_depth.max()),
-        'mean_depth': float(valid_depth.mean()),
-        'median_depth': float(np.median(valid_depth))
+        'valid_percentage': 100.0 * count / depth_map.size,
+        'min_depth': float(min_depth),
+        'max_depth': float(max_depth),
+        'mean_depth': float(total / count)
     }
+    if compute_median:
+        stats['median_depth'] = partition_median(depth_map[depth_map > 0])
     
     return stats
@@ -1,13 +1,40 @@
+import os
+import shutil
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
 from ultralytics import YOLO
 import cv2
 import numpy as np
+import torch
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, exports still land atomically
+    fcntl = None
+
+
+@contextmanager
+def _export_lock(engine_path):
+    """Hold an exclusive file lock next to engine_path while a worker exports it."""
+    if fcntl is None:
+        yield
+        return
+    with open(engine_path.with_name(engine_path.name + '.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
 
 class ObjectDetector:
     """
     YOLOv8 object detector for stereo vision pipeline.
     """
     
-    def __init__(self, model_name='yolov8n.pt', confidence=0.5, iou_threshold=0.45):
+    def __init__(self, model_name='yolov8n.pt', confidence=0.5, iou_threshold=0.45,
+                 use_tensorrt=False, max_batch=1, imgsz=(384, 1248)):
         """
         Initialize YOLO detector.
         
@@ -20,13 +47,82 @@ class ObjectDetector:
                        x = extra large (slowest, most accurate)
             confidence: Detection confidence threshold (0.0-1.0)
             iou_threshold: IoU threshold for Non-Maximum Suppression
+            use_tensorrt: Run a TensorRT FP16 engine (exported once and cached
+                          next to the .pt file) instead of the PyTorch model
+            max_batch: Largest batch the TensorRT engine must accept
+            imgsz: Fixed (height, width) input size for the TensorRT engine,
+                   multiples of 32 (KITTI 375x1242 pads to 384x1248)
         """
-        print(f"Loading YOLO model: {model_name}...")
-        self.model = YOLO(model_name)
         self.confidence = confidence
         self.iou_threshold = iou_threshold
+        self._infer_kwargs = {}
+        
+        # Input size is fixed, so let cuDNN pick the fastest conv algorithms once
+        if torch.cuda.is_available():
+            torch.backends.cudnn.benchmark = True
+        
+        if use_tensorrt:
+            engine_path = self._tensorrt_engine(model_name, max_batch, imgsz)
+            if engine_path != model_name:
+                model_name = engine_path
+                self._infer_kwargs['imgsz'] = imgsz
+        
+        print(f"Loading YOLO model: {model_name}...")
+        self.model = YOLO(model_name)
+        
+        # Class-id -> name lookup table, so names are gathered with one index op
+        names = self.model.names
+        self.class_names = np.array([names[i] for i in range(len(names))], dtype=object)
         print("YOLO model loaded successfully")
     
+    def _tensorrt_engine(self, model_name, max_batch, imgsz):
+        """
+        Get a cached TensorRT FP16 engine for model_name, exporting it on first use.
+        
+        The engine file name encodes batch size and input size so a changed
+        configuration triggers a fresh export. Concurrent workers serialize on
+        a lock file, and each export runs on a per-process copy of the weights
+        and is moved into place with os.replace, so a half-written engine is
+        never visible.
+        
+        Returns:
+            path: Engine path, or model_name if TensorRT can't be used
+        """
+        # An engine can only run on a GPU, even if one was exported earlier
+        if not torch.cuda.is_available():
+            print("CUDA not available, using PyTorch model instead of TensorRT")
+            return model_name
+        
+        height, width = imgsz
+        model_path = Path(model_name)
+        engine_path = model_path.with_name(f"{model_path.stem}_fp16_b{max_batch}_{height}x{width}.engine")
+        
+        if engine_path.exists():
+            return str(engine_path)
+        
+        try:
+            with _export_lock(engine_path):
+                # Another worker may have finished the export while we waited
+                if engine_path.exists():
+                    return str(engine_path)
+                
+                print(f"Exporting {model_name} to TensorRT FP16 (one-time, may take a few minutes)...")
+                # Loading first downloads the weights if needed
+                source = getattr(YOLO(model_name), 'ckpt_path', None) or model_name
+                temp_weights = engine_path.with_name(f"{engine_path.stem}.{os.getpid()}.pt")
+                shutil.copyfile(source, temp_weights)
+                try:
+                    exported = YOLO(str(temp_weights)).export(format='engine', half=True, dynamic=True,
+                                                              batch=max_batch, imgsz=list(imgsz))
+                    os.replace(exported, engine_path)
+                finally:
+                    for leftover in (temp_weights, temp_weights.with_suffix('.onnx')):
+                        leftover.unlink(missing_ok=True)
+            return str(engine_path)
+        except Exception as e:
+            print(f"TensorRT export failed ({e}), using PyTorch model")
+            return model_name
+    
     def detect(self, image, conf=None, iou=None):
         """
         Detect objects in an image.
@@ -43,34 +139,68 @@ class ObjectDetector:
                        - class_name: String class name
                        - confidence: Detection confidence (0.0-1.0)
         """
+        return self.detect_batch([image], conf=conf, iou=iou)[0]
+    
+    def detect_batch(self, images, conf=None, iou=None):
+        """
+        Detect objects in several images with a single forward pass.
+        
+        Args:
+            images: List of input images (H x W x 3) BGR
+            conf: Override confidence threshold
+            iou: Override IoU threshold
+            
+        Returns:
+            batch_detections: One list of detection dictionaries per image
+                              (same format as detect())
+        """
+        return [detections_to_dicts(dets) for dets in self.detect_arrays(images, conf=conf, iou=iou)]
+    
+    def detect_arrays(self, images, conf=None, iou=None):
+        """
+        Detect objects in several images, returning struct-of-arrays results.
+        
+        Images should share the same shape so Ultralytics packs them into
+        one (B, 3, H, W) tensor instead of running them one by one.
+        
+        Args:
+            images: List of input images (H x W x 3) BGR
+            conf: Override confidence threshold
+            iou: Override IoU threshold
+            
+        Returns:
+            batch_detections: One dictionary per image with:
+                              - bbox: (N, 4) float32 [x1, y1, x2, y2]
+                              - class_id: (N,) int32
+                              - class_name: (N,) object array of strings
+                              - confidence: (N,) float32
+        """
         # Use provided thresholds or defaults
         conf_thresh = conf if conf is not None else self.confidence
         iou_thresh = iou if iou is not None else self.iou_threshold
         
-        # Run inference
-        results = self.model(image, conf=conf_thresh, iou=iou_thresh, verbose=False)
+        # Run inference on the whole batch at once
+        results = self.model(list(images), conf=conf_thresh, iou=iou_thresh, verbose=False,
+                             **self._infer_kwargs)
         
-        # Parse results
-        detections = []
+        # Each result's boxes.data is one (N, 6) tensor [x1, y1, x2, y2, conf, cls];
+        # concatenate them on the device so the whole batch needs one D->H copy
+        counts = [len(result.boxes) for result in results]
+        packed = torch.cat([result.boxes.data for result in results]).cpu().numpy()
         
-        # results is a list (batch of images), we only have one image
-        result = results[0]
+        # Parse results (one entry per input image)
+        batch_detections = []
         
-        # Extract boxes, classes, and confidences
-        boxes = result.boxes.xyxy.cpu().numpy()  # Bounding boxes [x1, y1, x2, y2]
-        classes = result.boxes.cls.cpu().numpy()  # Class IDs
-        confidences = result.boxes.conf.cpu().numpy()  # Confidence scores
+        for data in np.split(packed, np.cumsum(counts)[:-1]):
+            class_ids = data[:, -1].astype(np.int32)
+            batch_detections.append({
+                'bbox': data[:, :4].astype(np.float32),  # Bounding boxes [x1, y1, x2, y2]
+                'class_id': class_ids,
+                'class_name': self.class_names[class_ids],
+                'confidence': data[:, -2].astype(np.float32)  # Confidence scores
+            })
         
-        for box, cls_id, conf in zip(boxes, classes, confidences):
-            detection = {
-                'bbox': box.tolist(),  # [x1, y1, x2, y2]
-                'class_id': int(cls_id),
-                'class_name': self.model.names[int(cls_id)],
-                'confidence': float(conf)
-            }
-            detections.append(detection)
-        
-        return detections
+        return batch_detections
     
     def draw_detections(self, image, detections):
         """
@@ -104,3 +234,45 @@ class ObjectDetector:
                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
         
         return annotated
+
+
+def detections_to_dicts(detections):
+    """
+    Convert struct-of-arrays detections to a list of detection dictionaries.
+    
+    Args:
+        detections: Dictionary of arrays from ObjectDetector.detect_arrays()
+        
+    Returns:
+        detections: List of dictionaries (bbox, class_id, class_name, confidence)
+    """
+    return [
+        {
+            'bbox': bbox,
+            'class_id': class_id,
+            'class_name': class_name,
+            'confidence': confidence
+        }
+        for bbox, class_id, class_name, confidence in zip(
+            detections['bbox'].tolist(),
+            detections['class_id'].tolist(),
+            detections['class_name'].tolist(),
+            detections['confidence'].tolist()
+        )
+    ]
+
+
+@lru_cache(maxsize=4)
+def get_detector(model_name='yolov8n.pt', confidence=0.5, **kwargs):
+    """
+    Shared ObjectDetector for a configuration (model loaded once per process).
+    
+    Args:
+        model_name: YOLO model to use
+        confidence: Detection confidence threshold (0.0-1.0)
+        **kwargs: Other ObjectDetector arguments (must be hashable)
+        
+    Returns:
+        detector: Cached ObjectDetector instance
+    """
+    return ObjectDetector(model_name=model_name, confidence=confidence, **kwargs)
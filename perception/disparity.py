@@ -1,5 +1,6 @@
 import cv2
 import numpy as np
+from numba import njit, prange
 
 def create_stereo_sgbm(min_disparity=0, num_disparities=128, block_size=5):
     """
@@ -36,78 +37,297 @@ def create_stereo_sgbm(min_disparity=0, num_disparities=128, block_size=5):
     return stereo
 
 
-def compute_disparity(left_img, right_img, stereo=None):
+def cuda_stereo_available():
+    """
+    Check whether OpenCV was built with CUDA stereo support and a GPU is present.
+    
+    Returns:
+        available: True if cv2.cuda.createStereoSGM can be used
+    """
+    try:
+        return hasattr(cv2.cuda, 'createStereoSGM') and cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
+
+class CudaStereoSGM:
+    """
+    OpenCV CUDA StereoSGM with the same compute() interface as StereoSGBM.
+    
+    Device buffers are kept between frames so only the first frame allocates
+    GPU memory. Output is 16-bit fixed point with 4 fractional bits, like SGBM.
+    """
+    
+    def __init__(self, min_disparity=0, num_disparities=128, uniqueness_ratio=10):
+        """
+        Create CUDA semi-global matcher.
+        
+        Args:
+            min_disparity: Minimum disparity (usually 0)
+            num_disparities: Disparity search range (64, 128 or 256)
+            uniqueness_ratio: Margin in percentage by which best cost should "win"
+        """
+        self.matcher = cv2.cuda.createStereoSGM(
+            minDisparity=min_disparity,
+            numDisparities=num_disparities,
+            uniquenessRatio=uniqueness_ratio,
+            mode=cv2.STEREO_SGBM_MODE_HH4
+        )
+        self._left_gpu = cv2.cuda_GpuMat()
+        self._right_gpu = cv2.cuda_GpuMat()
+        self._disp_gpu = cv2.cuda_GpuMat()
+        self._disp_host = None
+    
+    def compute(self, left_gray, right_gray):
+        """
+        Compute fixed-point disparity on the GPU.
+        
+        Args:
+            left_gray: Left grayscale image (H x W) uint8
+            right_gray: Right grayscale image (H x W) uint8
+            
+        Returns:
+            disparity_fixed: Disparity (H x W) int16, scaled by 16 (reused between calls)
+        """
+        self._left_gpu.upload(left_gray)
+        self._right_gpu.upload(right_gray)
+        self._disp_gpu = self.matcher.compute(self._left_gpu, self._right_gpu, self._disp_gpu)
+        
+        if self._disp_host is None or self._disp_host.shape != left_gray.shape:
+            self._disp_host = np.empty(left_gray.shape, dtype=np.int16)
+        self._disp_gpu.download(self._disp_host)
+        return self._disp_host
+
+
+def create_stereo_matcher(min_disparity=0, num_disparities=128, block_size=5, use_cuda=None):
+    """
+    Create the fastest available stereo matcher.
+    
+    Uses CUDA StereoSGM when OpenCV has CUDA support and a GPU is present,
+    otherwise falls back to CPU StereoSGBM.
+    
+    Args:
+        min_disparity: Minimum disparity (usually 0)
+        num_disparities: Maximum disparity minus minimum (must be divisible by 16)
+        block_size: Matched block size for CPU SGBM (CUDA SGM uses a fixed census window)
+        use_cuda: Force CUDA on/off (None = auto-detect)
+        
+    Returns:
+        stereo: CudaStereoSGM or StereoSGBM object
+    """
+    if use_cuda is None:
+        use_cuda = cuda_stereo_available()
+    
+    if use_cuda:
+        return CudaStereoSGM(min_disparity=min_disparity, num_disparities=num_disparities)
+    
+    return create_stereo_sgbm(min_disparity=min_disparity, num_disparities=num_disparities,
+                              block_size=block_size)
+
+
+@njit(cache=True)
+def _fill_runs(line):
+    """
+    Fill zero runs of a 1D line in place from the nearest valid neighbors.
+    
+    Interior holes take the smaller (farther) of the two bounding
+    disparities so foreground does not bleed into background; holes at the
+    ends copy the single neighbor. Lines with no valid values are left as-is.
+    
+    Returns:
+        filled: True if the line had any valid value
+    """
+    n = line.shape[0]
+    last = -1
+    for i in range(n):
+        if line[i] > 0:
+            if last == -1:
+                # Leading hole: carry first valid value leftwards
+                for j in range(i):
+                    line[j] = line[i]
+            elif i - last > 1:
+                fill = min(line[last], line[i])
+                for j in range(last + 1, i):
+                    line[j] = fill
+            last = i
+    if last == -1:
+        return False
+    # Trailing hole: carry last valid value rightwards
+    for j in range(last + 1, n):
+        line[j] = line[last]
+    return True
+
+
+@njit(parallel=True, cache=True)
+def interpolate_disparity(disparity):
+    """
+    Fill invalid (zero) disparities in place by scanline interpolation.
+    
+    Each row is filled from its nearest valid left/right neighbors (taking
+    the minimum), then a column pass fills rows that had no valid pixels.
+    
+    Args:
+        disparity: Disparity map (H x W) float32, invalid pixels = 0
+        
+    Returns:
+        disparity: The same array, densified
+    """
+    height, width = disparity.shape
+    
+    # Row pass
+    empty_rows = 0
+    for y in prange(height):
+        if not _fill_runs(disparity[y]):
+            empty_rows += 1
+    
+    # Column pass for rows that had nothing to carry
+    if empty_rows > 0:
+        for x in prange(width):
+            _fill_runs(disparity[:, x])
+    
+    return disparity
+
+
+def compute_disparity(left_img, right_img, stereo=None, out=None, half_resolution=False,
+                      fill_holes=False):
     """
     Compute disparity map from stereo pair.
     
+    With half_resolution, matching runs on 2x downsampled images (about 8x
+    less SGM work) and the result is upsampled back to full size. The
+    stereo matcher should then be created with half the disparity range.
+    
     Args:
-        left_img: Left image (H x W x 3) BGR
-        right_img: Right image (H x W x 3) BGR
-        stereo: StereoSGBM object (if None, creates default)
+        left_img: Left image (H x W x 3) BGR, or (H x W) grayscale
+        right_img: Right image (H x W x 3) BGR, or (H x W) grayscale
+        stereo: StereoSGBM or CudaStereoSGM object (if None, creates default)
+        out: Optional preallocated (H x W) float32 output buffer
+        half_resolution: Match at half resolution and upsample
+        fill_holes: Fill invalid pixels from nearest valid neighbors
         
     Returns:
         disparity: Disparity map (H x W) in pixels (float32)
     """
-    # Convert to grayscale (SGBM works on grayscale)
-    left_gray = cv2.cvtColor(left_img, cv2.COLOR_BGR2GRAY)
-    right_gray = cv2.cvtColor(right_img, cv2.COLOR_BGR2GRAY)
+    # Convert to grayscale (SGBM works on grayscale); gray input is used as-is
+    left_gray = left_img if left_img.ndim == 2 else cv2.cvtColor(left_img, cv2.COLOR_BGR2GRAY)
+    right_gray = right_img if right_img.ndim == 2 else cv2.cvtColor(right_img, cv2.COLOR_BGR2GRAY)
+    height, width = left_gray.shape
     
     # Create stereo matcher if not provided
     if stereo is None:
-        stereo = create_stereo_sgbm()
+        stereo = create_stereo_sgbm(num_disparities=64 if half_resolution else 128)
+    
+    if half_resolution:
+        left_gray = cv2.pyrDown(left_gray)
+        right_gray = cv2.pyrDown(right_gray)
     
     # Compute disparity
     # Result is in fixed-point format (16-bit signed) with 4 fractional bits
     disparity_fixed = stereo.compute(left_gray, right_gray)
     
-    # Convert from fixed-point to floating-point
-    disparity = disparity_fixed.astype(np.float32) / 16.0
+    if out is None:
+        out = np.empty((height, width), dtype=np.float32)
     
-    # Invalid disparities are marked as negative or very large
-    # Set them to 0 for visualization
-    disparity[disparity < 0] = 0
+    if half_resolution:
+        # Fixed-point to float, doubled for full-resolution pixel units
+        disparity_half = np.divide(disparity_fixed, 8.0, dtype=np.float32)
+        
+        # Mark invalid (negative) values as 0
+        np.maximum(disparity_half, 0.0, out=disparity_half)
+        if fill_holes:
+            interpolate_disparity(disparity_half)
+        disparity = cv2.resize(disparity_half, (width, height), dst=out,
+                               interpolation=cv2.INTER_LINEAR)
+        
+        # Bilinear upsampling blends the 0s of holes into their valid neighbours,
+        # giving small spurious disparities (phantom far depths) at hole borders.
+        # Upsample a validity mask the same way and re-zero every pixel that
+        # touched a hole (uint8 resize is exact, so fully valid stays 255)
+        valid_half = (disparity_half > 0).view(np.uint8) * np.uint8(255)
+        valid = cv2.resize(valid_half, (width, height), interpolation=cv2.INTER_LINEAR)
+        disparity[valid < 255] = 0.0
+    else:
+        # Convert from fixed-point to floating-point
+        disparity = np.divide(disparity_fixed, 16.0, out=out, dtype=np.float32)
+        
+        # Invalid disparities are marked as negative or very large
+        # Set them to 0 for visualization (in place, no boolean temporary)
+        np.maximum(disparity, 0.0, out=disparity)
+        if fill_holes:
+            interpolate_disparity(disparity)
     
     return disparity
 
 
-def normalize_disparity_for_display(disparity):
+@njit(cache=True)
+def _valid_range(disparity):
+    """Min and max of the valid (> 0) disparities, plus their count."""
+    count = 0
+    min_disp = 1e30
+    max_disp = -1e30
+    height, width = disparity.shape
+    for y in range(height):
+        for x in range(width):
+            d = disparity[y, x]
+            if d > 0:
+                count += 1
+                if d < min_disp:
+                    min_disp = d
+                if d > max_disp:
+                    max_disp = d
+    return count, min_disp, max_disp
+
+
+@njit(parallel=True, cache=True)
+def _normalize_kernel(disparity, min_disp, scale, out):
+    """Scale valid disparities to 0-255, invalid pixels to 0."""
+    height, width = disparity.shape
+    for y in prange(height):
+        for x in range(width):
+            d = disparity[y, x]
+            out[y, x] = np.uint8((d - min_disp) * scale) if d > 0 else 0
+
+
+def normalize_disparity_for_display(disparity, out=None):
     """
     Normalize disparity map to 0-255 range for visualization.
     
     Args:
         disparity: Disparity map (H x W) float
+        out: Optional preallocated (H x W) uint8 output buffer
         
     Returns:
         disparity_viz: Normalized disparity (H x W) uint8
     """
-    # Get valid (non-zero) disparities
-    valid_disp = disparity[disparity > 0]
+    if out is None:
+        out = np.empty(disparity.shape, dtype=np.uint8)
     
-    if len(valid_disp) == 0:
-        return np.zeros_like(disparity, dtype=np.uint8)
+    # Pass 1: min/max of valid (non-zero) disparities
+    count, min_disp, max_disp = _valid_range(disparity)
     
-    # Normalize to 0-255 based on min/max of valid disparities
-    min_disp = valid_disp.min()
-    max_disp = valid_disp.max()
+    if count == 0:
+        out[:] = 0
+        return out
     
-    disparity_viz = np.zeros_like(disparity, dtype=np.uint8)
-    valid_mask = disparity > 0
-    disparity_viz[valid_mask] = ((disparity[valid_mask] - min_disp) / (max_disp - min_disp) * 255).astype(np.uint8)
+    # Pass 2: normalize to 0-255 based on min/max of valid disparities
+    scale = 255.0 / (max_disp - min_disp) if max_disp > min_disp else 0.0
+    _normalize_kernel(disparity, min_disp, scale, out)
     
-    return disparity_viz
+    return out
 
 
-def apply_colormap(disparity_normalized):
+def apply_colormap(disparity_normalized, out=None):
     """
     Apply color map to disparity for better visualization.
     
     Args:
         disparity_normalized: Normalized disparity (H x W) uint8
+        out: Optional preallocated (H x W x 3) uint8 output buffer
         
     Returns:
         disparity_color: Colored disparity map (H x W x 3) BGR
     """
     # Apply TURBO colormap: blue (far) to red (close)
-    disparity_color = cv2.applyColorMap(disparity_normalized, cv2.COLORMAP_TURBO)
+    disparity_color = cv2.applyColorMap(disparity_normalized, cv2.COLORMAP_TURBO, dst=out)
     
     return disparity_color
@@ -1,80 +1,371 @@
 import numpy as np
 import cv2
+from functools import lru_cache
+from numba import njit, prange
+from scipy.spatial import cKDTree
 
-def generate_point_cloud(depth_map, rgb_image, camera_params, max_depth=50.0):
+from calibration.parser import intrinsics_inverse, get_Q
+
+# CuPy GPU back-projection (optional, falls back to the Numba CPU kernel)
+try:
+    import cupy as cp
+    _gpu_available = cp.cuda.runtime.getDeviceCount() > 0
+except (ImportError, RuntimeError):
+    cp = None
+    _gpu_available = False
+
+# Shared random generator (seeded once, not per downsample call)
+_rng = np.random.default_rng()
+
+
+@njit(parallel=True, cache=True)
+def _count_valid_rows(depth_map, max_depth, counts):
+    """Pass 1: number of valid depths (0 < z < max_depth) in each row."""
+    height, width = depth_map.shape
+    for v in prange(height):
+        n = 0
+        for u in range(width):
+            z = depth_map[v, u]
+            if z > 0 and z < max_depth:
+                n += 1
+        counts[v] = n
+
+
+# No fastmath here: the validity test must evaluate exactly as in _count_valid_rows
+# (fastmath's no-NaN assumption may fold it differently for NaN/inf depths), or
+# rows would write past the slices pass 1 sized for them
+@njit(parallel=True, cache=True)
+def _backproject_kernel(depth_map, bgr_image, ray_u, ray_v, max_depth, offsets, points, colors):
+    """Pass 2: back-project valid pixels (x = ray_u[u] * z, y = ray_v[v] * z), each row writing from its own offset."""
+    height, width = depth_map.shape
+    for v in prange(height):
+        i = offsets[v]
+        ray_y = ray_v[v]
+        for u in range(width):
+            z = depth_map[v, u]
+            if z > 0 and z < max_depth:
+                points[i, 0] = ray_u[u] * z
+                points[i, 1] = ray_y * z
+                points[i, 2] = z
+                # BGR -> RGB
+                colors[i, 0] = bgr_image[v, u, 2]
+                colors[i, 1] = bgr_image[v, u, 1]
+                colors[i, 2] = bgr_image[v, u, 0]
+                i += 1
+
+
+@lru_cache(maxsize=8)
+def _ray_tables(k00, k02, k11, k12, width, height):
+    """
+    Per-column and per-row ray slopes, (u - cx) / fx and (v - cy) / fy.
+    
+    Cached per calibration and resolution; returned arrays are read-only.
+    """
+    ray_u = (np.arange(width) * k00 + k02).astype(np.float32)
+    ray_v = (np.arange(height) * k11 + k12).astype(np.float32)
+    ray_u.flags.writeable = False
+    ray_v.flags.writeable = False
+    return ray_u, ray_v
+
+
+def _backproject_cupy(depth_map, bgr_image, K_inv, max_depth):
+    """
+    Back-project valid pixels on the GPU with CuPy.
+    
+    Inputs may be NumPy (uploaded once) or CuPy arrays already on the
+    device; only the final points and colors are copied back.
+    
+    Returns:
+        points: Nx3 float32 array (NumPy)
+        colors: Nx3 uint8 RGB array (NumPy)
+    """
+    depth = cp.asarray(depth_map)
+    bgr = cp.asarray(bgr_image)
+    
+    # Valid pixel coordinates (row-major, same order as the CPU kernel)
+    valid = (depth > 0) & (depth < max_depth)
+    v, u = cp.nonzero(valid)
+    z = depth[v, u].astype(cp.float32)
+    u = u.astype(cp.float32)
+    v = v.astype(cp.float32)
+    
+    # z * K_inv @ [u, v, 1] (Python float coefficients keep the math in float32)
+    k = K_inv.tolist()
+    x = (k[0][0] * u + k[0][1] * v + k[0][2]) * z
+    y = (k[1][0] * u + k[1][1] * v + k[1][2]) * z
+    points = cp.stack([x, y, z], axis=1)
+    
+    # BGR -> RGB, materialized contiguously (not a negative-stride view)
+    colors = cp.ascontiguousarray(bgr[valid][:, ::-1])
+    
+    return cp.asnumpy(points), cp.asnumpy(colors)
+
+
+def generate_point_cloud(depth_map, rgb_image, camera_params, max_depth=50.0, K_inv=None,
+                         use_gpu=None):
     """
     Generate 3D point cloud from depth map and RGB image.
     
+    On the CPU this runs as two parallel passes over the depth map (count
+    valid pixels per row, then fill the exactly-sized outputs), so no
+    full-image temporaries are created. With CuPy and a CUDA device the
+    whole back-projection runs on the GPU instead.
+    
     Args:
         depth_map: Depth map (H x W) in meters
         rgb_image: Color image (H x W x 3) BGR
         camera_params: Camera calibration parameters
         max_depth: Maximum depth to include (meters)
+        K_inv: Precomputed inverse camera matrix (default: from camera_params)
+        use_gpu: Force the CuPy path on/off (None = use it if available)
         
     Returns:
-        points: Nx3 array of 3D coordinates (X, Y, Z)
-        colors: Nx3 array of RGB colors (0-255)
+        points: Nx3 float32 array of 3D coordinates (X, Y, Z)
+        colors: Nx3 uint8 array of RGB colors (0-255)
     """
-    fx = camera_params['left']['fx']
-    fy = camera_params['left']['fy']
-    cx = camera_params['left']['cx']
-    cy = camera_params['left']['cy']
+    if K_inv is None:
+        K_inv = intrinsics_inverse(camera_params)
+    
+    if use_gpu is None:
+        use_gpu = _gpu_available
+    if use_gpu:
+        return _backproject_cupy(depth_map, rgb_image, K_inv, max_depth)
     
     height, width = depth_map.shape
     
-    # Create coordinate grids
-    u_coords, v_coords = np.meshgrid(np.arange(width), np.arange(height))
+    # Pass 1: count valid pixels per row, prefix sum gives each row's output offset
+    counts = np.empty(height, dtype=np.int64)
+    _count_valid_rows(depth_map, max_depth, counts)
+    offsets = np.zeros(height + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    
+    # Pass 2: fill exactly-sized outputs (intrinsics are skew-free, so
+    # K_inv @ [u, v, 1] separates into per-column and per-row tables)
+    ray_u, ray_v = _ray_tables(float(K_inv[0, 0]), float(K_inv[0, 2]),
+                               float(K_inv[1, 1]), float(K_inv[1, 2]), width, height)
+    n_points = offsets[-1]
+    points = np.empty((n_points, 3), dtype=np.float32)
+    colors = np.empty((n_points, 3), dtype=np.uint8)
+    _backproject_kernel(depth_map, rgb_image, ray_u, ray_v, max_depth, offsets, points, colors)
+    
+    return points, colors
+
+
+def _disparity_bounds(fb, min_depth, max_depth):
+    """
+    Disparity range (d_lo, d_hi] whose depth fb / d lies in [min_depth, max_depth).
+    
+    Membership is decided on the disparity itself, so both passes of the
+    fused back-projection (and the OpenCV variant) agree exactly; no
+    division rounding can move a pixel across the bounds between passes.
+    """
+    return max(0.1, fb / max_depth), fb / min_depth
+
+
+@njit(parallel=True, cache=True)
+def _count_valid_disparity_rows(disparity, d_lo, d_hi, counts):
+    """Pass 1 (fused): number of disparities per row in (d_lo, d_hi]."""
+    height, width = disparity.shape
+    for v in prange(height):
+        n = 0
+        for u in range(width):
+            d = disparity[v, u]
+            if d > d_lo and d <= d_hi:
+                n += 1
+        counts[v] = n
+
+
+# Same flags and the same validity test as _count_valid_disparity_rows: pass 1
+# sizes each row's output slice, so the two must never disagree
+@njit(parallel=True, cache=True)
+def _disparity_backproject_kernel(disparity, bgr_image, fb, d_lo, d_hi,
+                                  ray_u, ray_v, offsets, points, colors):
+    """Pass 2 (fused): disparity -> depth -> 3D point, without a depth map in between."""
+    height, width = disparity.shape
+    for v in prange(height):
+        i = offsets[v]
+        ray_y = ray_v[v]
+        for u in range(width):
+            d = disparity[v, u]
+            if d > d_lo and d <= d_hi:
+                z = fb / d
+                points[i, 0] = ray_u[u] * z
+                points[i, 1] = ray_y * z
+                points[i, 2] = z
+                # BGR -> RGB
+                colors[i, 0] = bgr_image[v, u, 2]
+                colors[i, 1] = bgr_image[v, u, 1]
+                colors[i, 2] = bgr_image[v, u, 0]
+                i += 1
+
+
+def disparity_to_point_cloud(disparity, rgb_image, camera_params, min_depth=0.5, max_depth=50.0,
+                             K_inv=None):
+    """
+    Generate 3D point cloud directly from a disparity map.
+    
+    Computes the same cloud as compute_depth_map() followed by
+    generate_point_cloud(), but depth is computed inline so the full depth
+    map is never written or re-read. Use it when only the point cloud is
+    needed.
+    
+    Not bit-identical to the two-step path: validity is decided on the
+    disparity (fb / max_depth < d <= fb / min_depth) and depth is kept in
+    float64 until stored, whereas the two-step path rounds depth to float32
+    before its range checks. Pixels whose depth lies within a float32 ulp of
+    min_depth or max_depth can therefore be included by one path and not the
+    other (typically a few dozen points on a KITTI-sized frame).
+    
+    Args:
+        disparity: Disparity map (H x W) float32 in pixels
+        rgb_image: Color image (H x W x 3) BGR
+        camera_params: Camera calibration parameters (with 'baseline')
+        min_depth: Minimum valid depth in meters
+        max_depth: Maximum depth to include (meters)
+        K_inv: Precomputed inverse camera matrix (default: from camera_params)
+        
+    Returns:
+        points: Nx3 float32 array of 3D coordinates (X, Y, Z)
+        colors: Nx3 uint8 array of RGB colors (0-255)
+    """
+    if K_inv is None:
+        K_inv = intrinsics_inverse(camera_params)
     
-    # Flatten to 1D arrays
-    u = u_coords.flatten()
-    v = v_coords.flatten()
-    z = depth_map.flatten()
+    fb = camera_params['left']['fx'] * camera_params['baseline']
+    d_lo, d_hi = _disparity_bounds(fb, min_depth, max_depth)
+    height, width = disparity.shape
+    
+    # Pass 1: count valid pixels per row, prefix sum gives each row's output offset
+    counts = np.empty(height, dtype=np.int64)
+    _count_valid_disparity_rows(disparity, d_lo, d_hi, counts)
+    offsets = np.zeros(height + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    
+    # Pass 2: fill exactly-sized outputs
+    ray_u, ray_v = _ray_tables(float(K_inv[0, 0]), float(K_inv[0, 2]),
+                               float(K_inv[1, 1]), float(K_inv[1, 2]), width, height)
+    n_points = offsets[-1]
+    points = np.empty((n_points, 3), dtype=np.float32)
+    colors = np.empty((n_points, 3), dtype=np.uint8)
+    _disparity_backproject_kernel(disparity, rgb_image, fb, d_lo, d_hi,
+                                  ray_u, ray_v, offsets, points, colors)
+    
+    return points, colors
+
+
+def reproject_disparity_to_point_cloud(disparity, rgb_image, camera_params, min_depth=0.5,
+                                      max_depth=50.0, Q=None):
+    """
+    Generate 3D point cloud from a disparity map with cv2.reprojectImageTo3D.
     
-    # Filter valid depths
-    valid = (z > 0) & (z < max_depth)
+    Same points as disparity_to_point_cloud(), computed by OpenCV's
+    vectorized reprojection and a boolean mask instead of the Numba kernels.
+    It writes a full (H x W x 3) float32 buffer before masking.
     
-    u = u[valid]
-    v = v[valid]
-    z = z[valid]
+    Args:
+        disparity: Disparity map (H x W) float32 in pixels
+        rgb_image: Color image (H x W x 3) BGR
+        camera_params: Camera calibration parameters (with 'baseline')
+        min_depth: Minimum valid depth in meters
+        max_depth: Maximum depth to include (meters)
+        Q: Precomputed reprojection matrix (default: get_Q(camera_params))
+        
+    Returns:
+        points: Nx3 float32 array of 3D coordinates (X, Y, Z)
+        colors: Nx3 uint8 array of RGB colors (0-255)
+    """
+    if Q is None:
+        Q = get_Q(camera_params)
     
-    # Convert to 3D coordinates
-    x = (u - cx) * z / fx
-    y = (v - cy) * z / fy
+    xyz = cv2.reprojectImageTo3D(disparity, Q)
     
-    # Stack into Nx3 array
-    points = np.stack([x, y, z], axis=1)
+    # Same disparity-space validity test as disparity_to_point_cloud
+    d_lo, d_hi = _disparity_bounds(camera_params['left']['fx'] * camera_params['baseline'],
+                                   min_depth, max_depth)
+    # (compared in float64, as in the Numba kernels; numpy would otherwise
+    # round the bounds to float32)
+    compare64 = (np.float64, np.float64, np.bool_)
+    mask = np.greater(disparity, d_lo, signature=compare64)
+    mask &= np.less_equal(disparity, d_hi, signature=compare64)
     
-    # Get colors (convert BGR to RGB)
-    rgb_flat = rgb_image.reshape(-1, 3)
-    colors = rgb_flat[valid][:, ::-1]
+    points = xyz[mask]
+    colors = np.ascontiguousarray(rgb_image[mask][:, ::-1])  # BGR -> RGB
     
     return points, colors
 
 
-def downsample_point_cloud(points, colors, target_points=10000):
+def voxel_downsample_point_cloud(points, colors, voxel_size=0.2):
+    """
+    Downsample point cloud on a voxel grid (one averaged point per voxel).
+    
+    Points are quantized to integer voxel coordinates, packed into one
+    int64 key per point and grouped with np.unique; positions and colors
+    are then averaged per voxel with np.bincount.
+    
+    Args:
+        points: Nx3 array of 3D points
+        colors: Nx3 uint8 array of RGB colors
+        voxel_size: Voxel edge length (meters)
+        
+    Returns:
+        downsampled_points: Mx3 float32 array of voxel centroids
+        downsampled_colors: Mx3 uint8 array of mean voxel colors
+    """
+    if len(points) == 0:
+        return points.astype(np.float32), colors
+    
+    # Non-negative voxel coordinates, packed as (ix * ny + iy) * nz + iz
+    voxels = np.floor(points / voxel_size).astype(np.int64)
+    voxels -= voxels.min(axis=0)
+    nx, ny, nz = voxels.max(axis=0) + 1
+    if float(nx) * float(ny) * float(nz) >= 2**63:
+        raise ValueError(f"Voxel grid too large for voxel_size={voxel_size}")
+    keys = (voxels[:, 0] * ny + voxels[:, 1]) * nz + voxels[:, 2]
+    
+    _, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse)
+    
+    # Per-voxel means, one weighted bincount per channel
+    n_voxels = len(counts)
+    downsampled_points = np.empty((n_voxels, 3), dtype=np.float32)
+    downsampled_colors = np.empty((n_voxels, 3), dtype=np.uint8)
+    for k in range(3):
+        downsampled_points[:, k] = np.bincount(inverse, weights=points[:, k]) / counts
+        downsampled_colors[:, k] = np.rint(np.bincount(inverse, weights=colors[:, k]) / counts)
+    
+    return downsampled_points, downsampled_colors
+
+
+def downsample_point_cloud(points, colors, target_points=10000, voxel_size=None):
     """
     Downsample point cloud using random sampling.
     
     This is much faster than voxel grid filtering and produces
-    good results for visualization purposes.
+    good results for visualization purposes. Pass voxel_size to get
+    a voxel grid instead (see voxel_downsample_point_cloud).
     
     Args:
         points: Nx3 array of 3D points
         colors: Nx3 array of RGB colors
         target_points: Target number of points after downsampling
+        voxel_size: Voxel edge length in meters (None = random sampling)
         
     Returns:
-        downsampled_points: Mx3 array (M <= target_points)
+        downsampled_points: Mx3 array (M <= target_points when random sampling)
         downsampled_colors: Mx3 array
     """
+    if voxel_size is not None:
+        return voxel_downsample_point_cloud(points, colors, voxel_size)
+    
     n_points = len(points)
     
     # If we already have fewer points than target, return as-is
     if n_points <= target_points:
         return points, colors
     
-    # Random sampling without replacement
-    indices = np.random.choice(n_points, target_points, replace=False)
+    # Random sampling without replacement; shuffle=False lets the Generator
+    # pick sparse subsets without permuting all n_points indices
+    indices = _rng.choice(n_points, target_points, replace=False, shuffle=False)
     
     # Select the random subset
     downsampled_points = points[indices]
@@ -87,6 +378,9 @@ def filter_point_cloud_by_objects(points, colors, localized_objects, margin=0.5)
     """
     Extract point cloud regions around detected objects.
     
+    Builds one KD-tree over the points and runs a radius query per object
+    (in parallel) instead of scanning every point for every object.
+    
     Args:
         points: Nx3 array of all points
         colors: Nx3 array of colors
@@ -98,23 +392,23 @@ def filter_point_cloud_by_objects(points, colors, localized_objects, margin=0.5)
     """
     object_clouds = []
     
-    for obj in localized_objects:
-        obj_x = obj['position_3d']['X']
-        obj_y = obj['position_3d']['Y']
-        obj_z = obj['position_3d']['Z']
-        
-        # Find points within margin of object position
-        distances = np.sqrt(
-            (points[:, 0] - obj_x)**2 + 
-            (points[:, 1] - obj_y)**2 + 
-            (points[:, 2] - obj_z)**2
-        )
-        
-        mask = distances < margin
-        
-        if np.any(mask):
-            obj_points = points[mask]
-            obj_colors = colors[mask]
+    if len(localized_objects) == 0 or len(points) == 0:
+        return object_clouds
+    
+    # Object centers as one (M, 3) array
+    centers = np.array([
+        [obj['position_3d']['X'], obj['position_3d']['Y'], obj['position_3d']['Z']]
+        for obj in localized_objects
+    ])
+    
+    # Find points within margin of each object position
+    tree = cKDTree(points)
+    neighbors = tree.query_ball_point(centers, r=margin, workers=-1, return_sorted=False)
+    
+    for obj, idx in zip(localized_objects, neighbors):
+        if idx:
+            obj_points = points[idx]
+            obj_colors = colors[idx]
             object_clouds.append({
                 'class_name': obj['class_name'],
                 'points': obj_points,
@@ -125,34 +419,58 @@ def filter_point_cloud_by_objects(points, colors, localized_objects, margin=0.5)
     return object_clouds
 
 
-def save_point_cloud_ply(points, colors, filename):
+# PLY vertex layout: float32 position + uchar RGB (15 bytes per point)
+PLY_VERTEX_DTYPE = np.dtype([
+    ('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+    ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')
+])
+
+
+def save_point_cloud_ply(points, colors, filename, binary=True):
     """
     Save point cloud to PLY file format.
     
+    Points are packed into one structured array and written in a single
+    call. Binary (binary_little_endian, 15 bytes per point) is the default;
+    pass binary=False for human-readable ASCII.
+    
     Args:
         points: Nx3 array of points
         colors: Nx3 array of RGB colors (0-255)
         filename: Output filename (e.g., 'cloud.ply')
+        binary: Write binary_little_endian (True) or ASCII (False)
     """
     n_points = len(points)
     
-    with open(filename, 'w') as f:
-        # Write header
-        f.write("ply\n")
-        f.write("format ascii 1.0\n")
-        f.write(f"element vertex {n_points}\n")
-        f.write("property float x\n")
-        f.write("property float y\n")
-        f.write("property float z\n")
-        f.write("property uchar red\n")
-        f.write("property uchar green\n")
-        f.write("property uchar blue\n")
-        f.write("end_header\n")
+    # Pack points and colors into PLY vertex records
+    vertices = np.empty(n_points, dtype=PLY_VERTEX_DTYPE)
+    vertices['x'] = points[:, 0]
+    vertices['y'] = points[:, 1]
+    vertices['z'] = points[:, 2]
+    vertices['red'] = colors[:, 0]
+    vertices['green'] = colors[:, 1]
+    vertices['blue'] = colors[:, 2]
+    
+    header = (
+        "ply\n"
+        f"format {'binary_little_endian' if binary else 'ascii'} 1.0\n"
+        f"element vertex {n_points}\n"
+        "property float x\n"
+        "property float y\n"
+        "property float z\n"
+        "property uchar red\n"
+        "property uchar green\n"
+        "property uchar blue\n"
+        "end_header\n"
+    )
+    
+    with open(filename, 'wb') as f:
+        f.write(header.encode('ascii'))
         
         # Write points
-        for i in range(n_points):
-            x, y, z = points[i]
-            r, g, b = colors[i].astype(int)
-            f.write(f"{x} {y} {z} {r} {g} {b}\n")
+        if binary:
+            vertices.tofile(f)
+        else:
+            np.savetxt(f, vertices, fmt='%.4f %.4f %.4f %d %d %d')
     
     print(f"Saved point cloud to {filename} ({n_points} points)")
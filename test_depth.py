@@ -2,19 +2,46 @@
 """
 Test depth map generation
 """
-import cv2
-import matplotlib.pyplot as plt
 import time
+import numpy as np
 from utils.loader import load_kitti_stereo_pair
 from perception.disparity import create_stereo_sgbm, compute_disparity
-from perception.depth import compute_depth_map, normalize_depth_for_display, apply_depth_colormap, compute_depth_statistics
+from perception.depth import (compute_depth_map, normalize_depth_for_display, apply_depth_colormap,
+                              colorize_depth, compute_depth_statistics)
 from calibration.parser import load_stereo_params
+from verify_setup import configure_cv2_threads
+
+def test_colorize_depth_matches_two_step():
+    """
+    The fused colorize_depth must match normalize + apply_depth_colormap exactly.
+    
+    Random KITTI-sized depth maps with holes, far values beyond the display
+    range and exact boundary depths.
+    """
+    rng = np.random.default_rng(0)
+    for _ in range(3):
+        depth_map = (rng.random((375, 1242)) * 60).astype(np.float32)
+        depth_map[rng.random(depth_map.shape) < 0.1] = 0
+        depth_map[0, :3] = (30.0, 15.0, 1e-3)
+        
+        fused = colorize_depth(depth_map, max_display_depth=30.0)
+        two_step = apply_depth_colormap(normalize_depth_for_display(depth_map, max_display_depth=30.0))
+        
+        mismatched = (fused != two_step).any(axis=2).sum()
+        assert mismatched == 0, f"{mismatched} pixels differ"
 
 def main():
+    configure_cv2_threads()
+    
     print("="*60)
     print("TESTING DEPTH MAP GENERATION")
     print("="*60)
     
+    # Synthetic check, no dataset needed
+    print("\nChecking fused depth colorization...")
+    test_colorize_depth_matches_two_step()
+    print("  colorize_depth matches normalize + colormap")
+    
     # Load calibration parameters
     print("\nLoading calibration parameters...")
     stereo_params = load_stereo_params('calibration/kitti_stereo_params.yaml')
@@ -63,13 +90,14 @@ def main():
     # Visualize
     print("\nGenerating visualizations...")
     depth_viz = normalize_depth_for_display(depth_map, max_display_depth=30.0)
-    depth_color = apply_depth_colormap(depth_viz)
+    depth_color = colorize_depth(depth_map, max_display_depth=30.0)
     
     # Display
     print("\nDisplaying results (close window to continue)...")
+    import matplotlib.pyplot as plt
     
-    left_rgb = cv2.cvtColor(left_img, cv2.COLOR_BGR2RGB)
-    depth_color_rgb = cv2.cvtColor(depth_color, cv2.COLOR_BGR2RGB)
+    left_rgb = left_img[..., ::-1]
+    depth_color_rgb = depth_color[..., ::-1]
     
     fig, axes = plt.subplots(2, 2, figsize=(14, 10))
     
@@ -2,20 +2,22 @@
 """
 Test YOLO object detection
 """
-import cv2
 import matplotlib.pyplot as plt
 import time
 from utils.loader import load_kitti_stereo_pair
-from perception.detector import ObjectDetector
+from perception.detector import get_detector
+from verify_setup import configure_cv2_threads
 
 def main():
+    configure_cv2_threads()
+    
     print("="*60)
     print("TESTING YOLO OBJECT DETECTION")
     print("="*60)
     
     # Initialize detector
     print("\nInitializing YOLO detector...")
-    detector = ObjectDetector(model_name='yolov8n.pt', confidence=0.5)
+    detector = get_detector('yolov8n.pt', 0.5)
     
     # Load image
     sequence_path = "data/kitti/2011_09_26/2011_09_26_drive_0001_sync"
@@ -45,8 +47,8 @@ def main():
     # Display
     print("\nDisplaying results (close window to continue)...")
     
-    left_rgb = cv2.cvtColor(left_img, cv2.COLOR_BGR2RGB)
-    annotated_rgb = cv2.cvtColor(annotated, cv2.COLOR_BGR2RGB)
+    left_rgb = left_img[..., ::-1]
+    annotated_rgb = annotated[..., ::-1]
     
     fig, axes = plt.subplots(1, 2, figsize=(16, 6))
     
@@ -3,16 +3,49 @@
 Test disparity computation
 """
 import cv2
-import matplotlib.pyplot as plt
+import numpy as np
 from utils.loader import load_kitti_stereo_pair
 from perception.disparity import create_stereo_sgbm, compute_disparity, normalize_disparity_for_display, apply_colormap
 import time
+from verify_setup import configure_cv2_threads
+
+def test_half_res_hole_borders():
+    """
+    Half-resolution upsampling must not blend holes into valid disparities.
+    
+    Synthetic pair with a uniform 20 px shift and textureless patches (holes):
+    every output pixel must be either invalid (0) or close to 20 px, never a
+    small in-between value from interpolating across a hole border.
+    """
+    true_disparity = 20
+    rng = np.random.default_rng(0)
+    texture = cv2.GaussianBlur((rng.random((376, 1280)) * 255).astype(np.uint8), (3, 3), 0)
+    left = texture[:, :1240].copy()
+    right = texture[:, true_disparity:1240 + true_disparity].copy()
+    for y, x in ((100, 400), (220, 700), (300, 1000)):
+        left[y:y + 60, x:x + 120] = 128
+        right[y:y + 60, x - true_disparity:x - true_disparity + 120] = 128
+    
+    disparity = compute_disparity(left, right, half_resolution=True)
+    
+    # Skip the left margin, where SGBM has no full search range
+    matched = disparity[:, 200:]
+    assert (matched == 0).any(), "synthetic pair should contain holes"
+    spurious = (matched > 0) & (matched < true_disparity - 1)
+    assert not spurious.any(), f"{spurious.sum()} pixels blended from hole borders"
 
 def main():
+    configure_cv2_threads()
+    
     print("="*60)
     print("TESTING DISPARITY COMPUTATION")
     print("="*60)
     
+    # Synthetic check, no dataset needed
+    print("\nChecking half-resolution hole borders...")
+    test_half_res_hole_borders()
+    print("  No disparities blended across holes")
+    
     # Load stereo pair
     sequence_path = "data/kitti/2011_09_26/2011_09_26_drive_0001_sync"
     frame_idx = 0
@@ -52,10 +85,11 @@ def main():
     
     # Display results
     print("\nDisplaying results (close window to continue)...")
+    import matplotlib.pyplot as plt
     
-    # Convert left image from BGR to RGB for matplotlib
-    left_rgb = cv2.cvtColor(left_img, cv2.COLOR_BGR2RGB)
-    disparity_rgb = cv2.cvtColor(disparity_color, cv2.COLOR_BGR2RGB)
+    # BGR -> RGB as reversed-channel views for matplotlib (no copy)
+    left_rgb = left_img[..., ::-1]
+    disparity_rgb = disparity_color[..., ::-1]
     
     fig, axes = plt.subplots(1, 3, figsize=(18, 5))
     
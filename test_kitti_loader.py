@@ -2,7 +2,7 @@
 """
 Test KITTI stereo image loader
 """
-from utils.loader import load_kitti_stereo_pair, display_stereo_pair, print_image_info
+from utils.loader import load_kitti_stereo_pair_rgb, display_stereo_pair, print_image_info
 
 def main():
     print("="*60)
@@ -16,8 +16,8 @@ def main():
     print(f"\nLoading frame {frame_idx} from sequence 0001...")
     
     try:
-        # Load stereo pair
-        left_img, right_img = load_kitti_stereo_pair(sequence_path, frame_idx)
+        # Load stereo pair (RGB, ready for display)
+        left_img, right_img = load_kitti_stereo_pair_rgb(sequence_path, frame_idx)
         
         print("\nSuccessfully loaded stereo pair")
         
@@ -27,7 +27,7 @@ def main():
         
         # Display images
         print("\nDisplaying images (close window to continue)...")
-        display_stereo_pair(left_img, right_img, f"KITTI Sequence 0001 - Frame {frame_idx}")
+        display_stereo_pair(left_img, right_img, f"KITTI Sequence 0001 - Frame {frame_idx}", bgr=False)
         
         print("\nTest completed successfully")
         print("\nNext: Try different frames (0-107) or sequences (0005, 0009)")
@@ -2,18 +2,46 @@
 """
 Test 3D object localization
 """
-import cv2
-import matplotlib.pyplot as plt
+import argparse
 import time
 import numpy as np
 from utils.loader import load_kitti_stereo_pair
 from perception.disparity import create_stereo_sgbm, compute_disparity
 from perception.depth import compute_depth_map
-from perception.detector import ObjectDetector
-from perception.localization_3d import localize_objects_3d, draw_3d_positions
+from perception.detector import get_detector
+from perception.localization_3d import localize_objects_arrays, objects_to_dicts, draw_3d_positions
 from calibration.parser import load_stereo_params
+from verify_setup import configure_cv2_threads
+
+def show_results(left_img, annotated, num_objects, frame_idx):
+    """Show the original and annotated images side-by-side with matplotlib."""
+    import matplotlib.pyplot as plt
+    
+    left_rgb = left_img[..., ::-1]
+    annotated_rgb = annotated[..., ::-1]
+    
+    fig, axes = plt.subplots(1, 2, figsize=(16, 6))
+    
+    axes[0].imshow(left_rgb)
+    axes[0].set_title('Original Image')
+    axes[0].axis('off')
+    
+    axes[1].imshow(annotated_rgb)
+    axes[1].set_title(f'3D Localized Objects ({num_objects} objects)')
+    axes[1].axis('off')
+    
+    plt.suptitle(f'3D Object Localization - Frame {frame_idx}', fontsize=14)
+    plt.tight_layout()
+    plt.show()
 
 def main():
+    parser = argparse.ArgumentParser(description="Test 3D object localization")
+    parser.add_argument('--no-viz', action='store_true',
+                        help="Skip the matplotlib window (and its import)")
+    args = parser.parse_args()
+    
+    configure_cv2_threads()
+    
     print("="*60)
     print("TESTING 3D OBJECT LOCALIZATION")
     print("="*60)
@@ -43,17 +71,18 @@ def main():
     # Detect objects
     print("\nDetecting objects...")
     start = time.time()
-    detector = ObjectDetector(model_name='yolov8n.pt', confidence=0.5)
-    detections = detector.detect(left_img)
+    detector = get_detector('yolov8n.pt', 0.5)
+    detections = detector.detect_arrays([left_img])[0]
     detect_time = time.time() - start
-    print(f"  Detected {len(detections)} objects in {detect_time:.3f}s")
+    print(f"  Detected {len(detections['confidence'])} objects in {detect_time:.3f}s")
     
     # Localize in 3D
     print("\nLocalizing objects in 3D...")
     start = time.time()
-    objects_3d = localize_objects_3d(detections, depth_map, stereo_params, depth_method='median')
+    objects = localize_objects_arrays(detections, depth_map, stereo_params, depth_method='median')
     loc_time = time.time() - start
-    print(f"  Localized {len(objects_3d)} objects in {loc_time:.3f}s")
+    num_objects = len(objects['depth'])
+    print(f"  Localized {num_objects} objects in {loc_time:.3f}s")
     
     total_time = depth_time + detect_time + loc_time
     print(f"\nTotal pipeline time: {total_time:.3f}s ({1/total_time:.1f} FPS)")
@@ -63,39 +92,27 @@ def main():
     print("3D LOCALIZED OBJECTS")
     print("="*60)
     
-    for i, obj in enumerate(objects_3d):
-        print(f"\n{i+1}. {obj['class_name'].upper()}")
-        print(f"   Confidence: {obj['confidence']:.2f}")
-        print(f"   Depth: {obj['depth']:.2f} meters")
+    # Columns straight from the struct-of-arrays result, no per-object dicts
+    rows = zip(objects['class_name'], objects['confidence'].tolist(), objects['depth'].tolist(),
+               objects['xyz'].tolist(), objects['distance'].tolist())
+    for i, (class_name, confidence, depth, (x, y, z), distance) in enumerate(rows):
+        print(f"\n{i+1}. {class_name.upper()}")
+        print(f"   Confidence: {confidence:.2f}")
+        print(f"   Depth: {depth:.2f} meters")
         print(f"   3D Position (camera frame):")
-        print(f"     X: {obj['position_3d']['X']:6.2f} m (left/right)")
-        print(f"     Y: {obj['position_3d']['Y']:6.2f} m (up/down)")
-        print(f"     Z: {obj['position_3d']['Z']:6.2f} m (forward)")
-        print(f"   Distance: {obj['distance']:.2f} meters")
+        print(f"     X: {x:6.2f} m (left/right)")
+        print(f"     Y: {y:6.2f} m (up/down)")
+        print(f"     Z: {z:6.2f} m (forward)")
+        print(f"   Distance: {distance:.2f} meters")
     
     # Visualize
-    print("\nGenerating visualization...")
-    annotated = draw_3d_positions(left_img, objects_3d)
-    
-    # Display
-    print("\nDisplaying results (close window to continue)...")
-    
-    left_rgb = cv2.cvtColor(left_img, cv2.COLOR_BGR2RGB)
-    annotated_rgb = cv2.cvtColor(annotated, cv2.COLOR_BGR2RGB)
-    
-    fig, axes = plt.subplots(1, 2, figsize=(16, 6))
-    
-    axes[0].imshow(left_rgb)
-    axes[0].set_title('Original Image')
-    axes[0].axis('off')
-    
-    axes[1].imshow(annotated_rgb)
-    axes[1].set_title(f'3D Localized Objects ({len(objects_3d)} objects)')
-    axes[1].axis('off')
-    
-    plt.suptitle(f'3D Object Localization - Frame {frame_idx}', fontsize=14)
-    plt.tight_layout()
-    plt.show()
+    if not args.no_viz:
+        print("\nGenerating visualization...")
+        annotated = draw_3d_positions(left_img, objects_to_dicts(objects))
+        
+        # Display
+        print("\nDisplaying results (close window to continue)...")
+        show_results(left_img, annotated, num_objects, frame_idx)
     
     print("\nTest completed successfully!")
     
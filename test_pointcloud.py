@@ -2,21 +2,91 @@
 """
 Test point cloud generation
 """
+import argparse
 import cv2
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
 import numpy as np
 import time
+from concurrent.futures import ThreadPoolExecutor
 from utils.loader import load_kitti_stereo_pair
 from perception.disparity import create_stereo_sgbm, compute_disparity
 from perception.depth import compute_depth_map
-from perception.detector import ObjectDetector
-from perception.localization_3d import localize_objects_3d
+from perception.detector import get_detector
+from perception.localization_3d import localize_objects_arrays
 from perception.pointcloud import (generate_point_cloud, downsample_point_cloud, 
                                    filter_point_cloud_by_objects, save_point_cloud_ply)
 from calibration.parser import load_stereo_params
+from verify_setup import configure_cv2_threads
+
+def show_open3d(points, colors):
+    """
+    Show the full point cloud with Open3D (OpenGL rendering).
+    
+    Returns:
+        shown: False if Open3D is not installed
+    """
+    try:
+        import open3d as o3d
+    except ImportError:
+        print("  open3d not installed (pip install open3d), falling back to matplotlib")
+        return False
+    
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(points.astype(np.float64))
+    pcd.colors = o3d.utility.Vector3dVector(colors / 255.0)
+    o3d.visualization.draw_geometries([pcd], window_name='3D Point Cloud')
+    return True
+
+def show_matplotlib(points_down, colors_down, objects, frame_idx):
+    """Show a strided 10,000-point sample of the cloud and the object positions with matplotlib."""
+    import matplotlib.pyplot as plt
+    from mpl_toolkits.mplot3d import Axes3D  # registers the '3d' projection
+    
+    print("  (Displaying up to 10,000 points for speed)")
+    
+    # Sample for visualization (strided views, no index array)
+    step = max(1, len(points_down) // 10000)
+    vis_points = points_down[::step][:10000]
+    vis_colors = colors_down[::step][:10000]
+    
+    # Create 3D plot
+    fig = plt.figure(figsize=(14, 10))
+    ax = fig.add_subplot(111, projection='3d')
+    
+    # Plot points (colors scaled to [0, 1] in float32, in place)
+    c = vis_colors.astype(np.float32)
+    np.multiply(c, 1.0 / 255.0, out=c)
+    ax.scatter(vis_points[:, 0], vis_points[:, 2], -vis_points[:, 1],
+              c=c, s=1, alpha=0.5)
+    
+    # Plot object positions (one collection; labels still need a text call each)
+    xyz = objects['xyz']
+    if len(xyz):
+        ax.scatter(xyz[:, 0], xyz[:, 2], -xyz[:, 1],
+                  c='red', s=100, marker='o', edgecolors='black')
+        for (x, y, z), class_name in zip(xyz.tolist(), objects['class_name']):
+            ax.text(x, z, -y, f"  {class_name}", fontsize=10)
+    
+    ax.set_xlabel('X (meters) - Left/Right')
+    ax.set_ylabel('Z (meters) - Forward')
+    ax.set_zlabel('Y (meters) - Up/Down')
+    ax.set_title(f'3D Point Cloud - Frame {frame_idx}\nRed dots = detected objects')
+    
+    # Set viewing angle
+    ax.view_init(elev=20, azim=45)
+    
+    plt.tight_layout()
+    plt.show()
 
 def main():
+    parser = argparse.ArgumentParser(description="Test point cloud generation")
+    parser.add_argument('--viz', choices=['matplotlib', 'open3d'], default='matplotlib',
+                        help="Point cloud viewer (open3d renders the full cloud on the GPU)")
+    parser.add_argument('--no-viz', action='store_true',
+                        help="Skip visualization (and the viewer imports)")
+    args = parser.parse_args()
+    
+    configure_cv2_threads()
+    
     print("="*60)
     print("TESTING POINT CLOUD GENERATION")
     print("="*60)
@@ -42,10 +112,10 @@ def main():
     
     # Detect and localize objects
     print("Detecting and localizing objects...")
-    detector = ObjectDetector(model_name='yolov8n.pt', confidence=0.5)
-    detections = detector.detect(left_img)
-    objects_3d = localize_objects_3d(detections, depth_map, stereo_params)
-    print(f"  Found {len(objects_3d)} objects")
+    detector = get_detector('yolov8n.pt', 0.5)
+    detections = detector.detect_arrays([left_img])[0]
+    objects = localize_objects_arrays(detections, depth_map, stereo_params)
+    print(f"  Found {len(objects['depth'])} objects")
     
     # Generate point cloud
     print("\nGenerating point cloud...")
@@ -53,11 +123,15 @@ def main():
     points, colors = generate_point_cloud(depth_map, left_img, stereo_params, max_depth=50.0)
     pc_time = time.time() - start
     
+    # Per-axis bounds in one reduction each (instead of six column passes)
+    mins = points.min(axis=0)
+    maxs = points.max(axis=0)
+    
     print(f"  Generated {len(points):,} points in {pc_time:.3f}s")
     print(f"  Point cloud bounds:")
-    print(f"    X: [{points[:, 0].min():.2f}, {points[:, 0].max():.2f}] meters")
-    print(f"    Y: [{points[:, 1].min():.2f}, {points[:, 1].max():.2f}] meters")
-    print(f"    Z: [{points[:, 2].min():.2f}, {points[:, 2].max():.2f}] meters")
+    print(f"    X: [{mins[0]:.2f}, {maxs[0]:.2f}] meters")
+    print(f"    Y: [{mins[1]:.2f}, {maxs[1]:.2f}] meters")
+    print(f"    Z: [{mins[2]:.2f}, {maxs[2]:.2f}] meters")
     
     # Downsample
     print("\nDownsampling point cloud...")
@@ -69,49 +143,22 @@ def main():
     print(f"  Downsampled to {len(points_down):,} points in {down_time:.3f}s")
     print(f"  Reduction: {reduction:.1f}%")
     
-    # Save full point cloud
-    print("\nSaving point cloud...")
-    save_point_cloud_ply(points_down, colors_down, 'outputs/scene_pointcloud.ply')
-    
-    # Visualize
-    print("\nVisualizing point cloud...")
-    print("  (Displaying 10,000 random points for speed)")
-    
-    # Sample for visualization
-    if len(points_down) > 10000:
-        indices = np.random.choice(len(points_down), 10000, replace=False)
-        vis_points = points_down[indices]
-        vis_colors = colors_down[indices]
-    else:
-        vis_points = points_down
-        vis_colors = colors_down
-    
-    # Create 3D plot
-    fig = plt.figure(figsize=(14, 10))
-    ax = fig.add_subplot(111, projection='3d')
-    
-    # Plot points
-    ax.scatter(vis_points[:, 0], vis_points[:, 2], -vis_points[:, 1],
-              c=vis_colors/255.0, s=1, alpha=0.5)
-    
-    # Plot object positions
-    for obj in objects_3d:
-        x = obj['position_3d']['X']
-        y = obj['position_3d']['Y']
-        z = obj['position_3d']['Z']
-        ax.scatter([x], [z], [-y], c='red', s=100, marker='o', edgecolors='black')
-        ax.text(x, z, -y, f"  {obj['class_name']}", fontsize=10)
-    
-    ax.set_xlabel('X (meters) - Left/Right')
-    ax.set_ylabel('Z (meters) - Forward')
-    ax.set_zlabel('Y (meters) - Up/Down')
-    ax.set_title(f'3D Point Cloud - Frame {frame_idx}\nRed dots = detected objects')
-    
-    # Set viewing angle
-    ax.view_init(elev=20, azim=45)
-    
-    plt.tight_layout()
-    plt.show()
+    # Save point cloud in the background while the visualization is built
+    print("\nSaving point cloud (binary PLY)...")
+    with ThreadPoolExecutor(max_workers=1) as save_pool:
+        save_future = save_pool.submit(save_point_cloud_ply, points_down, colors_down,
+                                       'outputs/scene_pointcloud.ply', binary=True)
+        
+        # Visualize
+        if not args.no_viz:
+            print("\nVisualizing point cloud...")
+            if args.viz == 'open3d':
+                print(f"  (Displaying all {len(points_down):,} points with Open3D)")
+            if args.viz != 'open3d' or not show_open3d(points_down, colors_down):
+                show_matplotlib(points_down, colors_down, objects, frame_idx)
+        
+        # Wait for the file (and surface any write error)
+        save_future.result()
     
     print("\nTest completed successfully!")
     print(f"\nPoint cloud saved to: outputs/scene_pointcloud.ply")
@@ -1,11 +1,159 @@
 import cv2
 import numpy as np
 import os
+import glob
+import atexit
+import queue
+import threading
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+try:
+    from PIL import Image
+    # pillow-simd versions carry a .postN suffix; plain Pillow's PNG decode is no faster than OpenCV's
+    _PIL_SIMD = '.post' in Image.__version__
+except ImportError:
+    _PIL_SIMD = False
+
+
+# Decodes left and right images concurrently (libpng releases the GIL)
+_IO_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix='kitti-io')
+
+
+def _decode_png(path, rgb=False):
+    """
+    Decode a color image to a writable (H x W x 3) uint8 array.
+    
+    Uses pillow-simd when it is installed (SIMD inflate and RGB unpack),
+    otherwise cv2.imread. Each backend produces its native channel order
+    and the other one is swapped in place.
+    
+    Args:
+        path: Image path
+        rgb: Return RGB instead of BGR
+    
+    Raises:
+        FileNotFoundError: If the image is missing or can't be decoded
+    """
+    if _PIL_SIMD:
+        try:
+            with Image.open(path) as pil_img:
+                img = np.array(pil_img.convert('RGB'))
+        except OSError:
+            raise FileNotFoundError(f"Image not found or unreadable: {path}")
+        if not rgb:
+            cv2.cvtColor(img, cv2.COLOR_RGB2BGR, dst=img)
+        return img
+    
+    # No separate exists() check: imread returning None covers it
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        raise FileNotFoundError(f"Image not found or unreadable: {path}")
+    if rgb:
+        # Channel swap into the decoded buffer, no second image allocated
+        cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
+    return img
+
+
+@lru_cache(maxsize=32)
+def _load_png(path, rgb=False):
+    """
+    Decode an image once and keep it in an in-memory LRU cache.
+    
+    The returned array is shared between callers and marked read-only;
+    copy it before modifying.
+    
+    Args:
+        path: Image path
+        rgb: Return RGB (converted in place after decode) instead of BGR
+    
+    Raises:
+        FileNotFoundError: If the image is missing or can't be decoded (not cached)
+    """
+    img = _decode_png(path, rgb)
+    img.flags.writeable = False
+    return img
+
+
+@lru_cache(maxsize=16)
+def kitti_sequence_frame_count(sequence_path):
+    """
+    Number of frames in a KITTI sequence (one directory scan, memoized).
+    
+    Args:
+        sequence_path: Path to sequence folder
+        
+    Returns:
+        count: Number of left (image_02) PNG frames
+        
+    Raises:
+        FileNotFoundError: If the sequence has no image_02/data directory
+    """
+    with os.scandir(os.path.join(sequence_path, 'image_02', 'data')) as entries:
+        return sum(1 for entry in entries if entry.name.endswith('.png'))
+
+
+class KittiSequence:
+    """
+    Frame access for one KITTI raw sequence (image_02 = left, image_03 = right).
+    
+    Image directories are resolved once, so loading a frame only formats
+    two file names.
+    """
+    
+    def __init__(self, sequence_path):
+        """
+        Args:
+            sequence_path: Path to sequence folder (e.g., 'data/kitti/2011_09_26/2011_09_26_drive_0001_sync')
+        """
+        self.sequence_path = sequence_path
+        self._left_dir = os.path.join(sequence_path, 'image_02', 'data')
+        self._right_dir = os.path.join(sequence_path, 'image_03', 'data')
+    
+    def paths(self, frame_idx):
+        """Left and right image paths for a frame (10-digit zero-padded names)."""
+        return f"{self._left_dir}/{frame_idx:010d}.png", f"{self._right_dir}/{frame_idx:010d}.png"
+    
+    def load(self, frame_idx, rgb=False):
+        """
+        Load a stereo pair (cached, read-only), decoding left and right in parallel.
+        
+        Args:
+            frame_idx: Frame number to load
+            rgb: Return RGB instead of BGR
+            
+        Returns:
+            left_img, right_img: (H x W x 3) images
+            
+        Raises:
+            IndexError: If frame_idx is outside the sequence
+        """
+        num_frames = kitti_sequence_frame_count(self.sequence_path)
+        if not 0 <= frame_idx < num_frames:
+            raise IndexError(f"Frame {frame_idx} out of range: {self.sequence_path} has "
+                             f"{num_frames} frames (0-{num_frames - 1})")
+        
+        left_path, right_path = self.paths(frame_idx)
+        left_future = _IO_POOL.submit(_load_png, left_path, rgb)
+        right_future = _IO_POOL.submit(_load_png, right_path, rgb)
+        return left_future.result(), right_future.result()
+
+
+@lru_cache(maxsize=16)
+def get_kitti_sequence(sequence_path):
+    """Shared KittiSequence for a sequence path."""
+    return KittiSequence(sequence_path)
+
 
 def load_kitti_stereo_pair(sequence_path, frame_idx=0):
     """
     Load a stereo pair from KITTI dataset.
     
+    Decoded frames are cached in memory, so repeated loads of the same
+    frame are a lookup. The returned images are read-only (use .copy() to
+    modify them).
+    
     Args:
         sequence_path: Path to sequence folder (e.g., 'data/kitti/2011_09_26/2011_09_26_drive_0001_sync')
         frame_idx: Frame number to load (0-107 for sequence 0001)
@@ -13,47 +161,183 @@ def load_kitti_stereo_pair(sequence_path, frame_idx=0):
     Returns:
         left_img: Left color image (H x W x 3) BGR
         right_img: Right color image (H x W x 3) BGR
+        
+    Raises:
+        IndexError: If frame_idx is outside the sequence (see kitti_sequence_frame_count)
     """
-    # Format frame number as 10-digit string with leading zeros
-    frame_str = f"{frame_idx:010d}"
+    return get_kitti_sequence(sequence_path).load(frame_idx)
+
+
+def load_kitti_stereo_pair_rgb(sequence_path, frame_idx=0):
+    """
+    Load a stereo pair from KITTI dataset in RGB order (for matplotlib).
+    
+    The channel swap is done in place on the decoded buffer. Like
+    load_kitti_stereo_pair, results are cached and read-only.
+    
+    Args:
+        sequence_path: Path to sequence folder
+        frame_idx: Frame number to load
+        
+    Returns:
+        left_img: Left color image (H x W x 3) RGB
+        right_img: Right color image (H x W x 3) RGB
+    """
+    return get_kitti_sequence(sequence_path).load(frame_idx, rgb=True)
+
+
+# (sequence_path, frame_idx) -> (left SharedMemory, right SharedMemory, shape, dtype), owned by this process
+_SHM_PAIRS = {}
+
+
+def _release_shared_pairs():
+    """Close and unlink every shared-memory block created by this process."""
+    for left_shm, right_shm, _, _ in _SHM_PAIRS.values():
+        for shm in (left_shm, right_shm):
+            shm.close()
+            shm.unlink()
+    _SHM_PAIRS.clear()
+
+
+atexit.register(_release_shared_pairs)
+
+
+def load_kitti_stereo_pair_shm(sequence_path, frame_idx=0):
+    """
+    Decode a stereo pair once into shared memory for worker processes.
+    
+    Repeated calls for the same frame return the same blocks. Workers
+    attach with attach_shared_image() instead of decoding the PNGs
+    themselves. The blocks are unlinked when this process exits.
+    
+    Args:
+        sequence_path: Path to sequence folder
+        frame_idx: Frame number to load
+        
+    Returns:
+        left_name: Shared memory name of the left image (BGR)
+        right_name: Shared memory name of the right image (BGR)
+        shape: Image shape (H, W, 3)
+        dtype: Image dtype (uint8)
+    """
+    key = (sequence_path, frame_idx)
+    if key not in _SHM_PAIRS:
+        left_img, right_img = load_kitti_stereo_pair(sequence_path, frame_idx)
+        blocks = []
+        for img in (left_img, right_img):
+            shm = shared_memory.SharedMemory(create=True, size=img.nbytes)
+            np.ndarray(img.shape, img.dtype, buffer=shm.buf)[:] = img
+            blocks.append(shm)
+        _SHM_PAIRS[key] = (blocks[0], blocks[1], left_img.shape, left_img.dtype)
+    
+    left_shm, right_shm, shape, dtype = _SHM_PAIRS[key]
+    return left_shm.name, right_shm.name, shape, dtype
+
+
+def attach_shared_image(name, shape, dtype=np.uint8):
+    """
+    Attach to an image created by load_kitti_stereo_pair_shm (zero-copy).
+    
+    Keep the returned SharedMemory alive while the array is in use and
+    call its close() (not unlink()) when done.
+    
+    Args:
+        name: Shared memory name
+        shape: Image shape
+        dtype: Image dtype
+        
+    Returns:
+        img: Image array backed by the shared block
+        shm: The attached SharedMemory handle
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype, buffer=shm.buf), shm
+
+
+def iter_kitti_stereo(sequence_path, start=0, stop=None, prefetch=4):
+    """
+    Iterate over a KITTI sequence, decoding frames ahead in a background thread.
+    
+    A producer thread keeps up to `prefetch` decoded pairs queued, so PNG
+    decode overlaps with whatever the caller does with each frame. Frames
+    are decoded fresh (not via the load cache) and are writable.
+    
+    Args:
+        sequence_path: Path to sequence folder
+        start: First frame index
+        stop: Stop before this frame index (None = end of sequence)
+        prefetch: Maximum number of decoded pairs held in the queue
+        
+    Yields:
+        frame_idx: Frame number
+        left_img: Left color image (H x W x 3) BGR
+        right_img: Right color image (H x W x 3) BGR
+    """
+    left_paths = sorted(glob.glob(os.path.join(sequence_path, 'image_02', 'data', '*.png')))
+    frame_indices = [int(os.path.splitext(os.path.basename(path))[0]) for path in left_paths]
+    frame_indices = [idx for idx in frame_indices if idx >= start and (stop is None or idx < stop)]
+    
+    frames = queue.Queue(maxsize=prefetch)
+    done = threading.Event()
     
-    # Construct paths to left and right images
-    left_path = os.path.join(sequence_path, 'image_02', 'data', f'{frame_str}.png')
-    right_path = os.path.join(sequence_path, 'image_03', 'data', f'{frame_str}.png')
+    def put(item):
+        # Block while the queue is full, but give up once the consumer is gone
+        while not done.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
     
-    # Check files exist
-    if not os.path.exists(left_path):
-        raise FileNotFoundError(f"Left image not found: {left_path}")
-    if not os.path.exists(right_path):
-        raise FileNotFoundError(f"Right image not found: {right_path}")
+    sequence = get_kitti_sequence(sequence_path)
     
-    # Load images
-    left_img = cv2.imread(left_path)
-    right_img = cv2.imread(right_path)
+    def producer():
+        try:
+            for idx in frame_indices:
+                left_path, right_path = sequence.paths(idx)
+                left_img = _decode_png(left_path)
+                right_img = _decode_png(right_path)
+                if not put((idx, left_img, right_img)):
+                    return
+        except Exception as e:
+            put(e)
+            return
+        put(None)  # End of sequence
     
-    # Check if loaded successfully
-    if left_img is None:
-        raise ValueError(f"Failed to load left image: {left_path}")
-    if right_img is None:
-        raise ValueError(f"Failed to load right image: {right_path}")
+    thread = threading.Thread(target=producer, daemon=True, name='kitti-prefetch')
+    thread.start()
     
-    return left_img, right_img
+    try:
+        while True:
+            item = frames.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        done.set()
 
 
-def display_stereo_pair(left_img, right_img, title="KITTI Stereo Pair"):
+def display_stereo_pair(left_img, right_img, title="KITTI Stereo Pair", bgr=True):
     """
     Display stereo pair side-by-side using matplotlib.
     
     Args:
-        left_img: Left image (BGR format from OpenCV)
-        right_img: Right image (BGR format from OpenCV)
+        left_img: Left image (BGR format from OpenCV, or RGB with bgr=False)
+        right_img: Right image (BGR format from OpenCV, or RGB with bgr=False)
         title: Window title
+        bgr: Whether the images are BGR and need converting for display
     """
     import matplotlib.pyplot as plt
     
-    # Convert BGR to RGB for matplotlib
-    left_rgb = cv2.cvtColor(left_img, cv2.COLOR_BGR2RGB)
-    right_rgb = cv2.cvtColor(right_img, cv2.COLOR_BGR2RGB)
+    # Reversed-channel views for matplotlib, no copy (RGB input is shown as-is)
+    if bgr:
+        left_rgb = left_img[..., ::-1]
+        right_rgb = right_img[..., ::-1]
+    else:
+        left_rgb, right_rgb = left_img, right_img
     
     # Create figure with two subplots
     fig, axes = plt.subplots(1, 2, figsize=(14, 5))